@@ -1,18 +1,80 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query, Header
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Header, Request
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable
+import asyncio
+import json
 import logging
 
-from app.models.story import StoryCreate, StoryResponse
+from app.models.story import StoryCreate, StoryResponse, StoryStatus
 from app.models.user import User
 from app.services.story_service import story_service
 from app.services.nlp_service import nlp_service
 from app.services.auth_service import auth_service
+from app.services.generation_queue import generation_queue, GenerationQueueFull
+from app.services.generation_jobs import generation_jobs
+from app.services.generation_flights import generation_flights
+from app.services.cancellation import GenerationAborted
+from app.services.semantic_cache import semantic_index
 from app.core.security import verify_token
+from app.core.timing import timed
 # Remove PDF service import and Response import
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# How often a blocking generation request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 1.0
+# Non-standard "client closed request"; the client is gone and never sees it
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+# Retry-After sent while the models are still loading or warming up
+MODEL_LOADING_RETRY_AFTER_SECONDS = 30
+
+def require_model_ready():
+    """Rejects generation with 503 and a Retry-After until the models are loaded and warmed up"""
+    if not nlp_service.is_ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Story generation is not available yet (model {nlp_service.load_state.replace('_', ' ')})",
+            headers={"Retry-After": str(MODEL_LOADING_RETRY_AFTER_SECONDS)}
+        )
+
+async def acquire_generation_slot(user: User, story_data: StoryCreate, wait: bool = True):
+    """Admits a generation request or rejects it with 429 and a computed Retry-After"""
+    try:
+        if not wait:
+            return generation_queue.admit(str(user.id), story_data.length.value)
+        return await generation_queue.acquire(str(user.id), story_data.length.value)
+    except GenerationQueueFull as e:
+        logger.warning(f"Generation rejected for user {user.username}: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+async def _until_disconnected(request: Request, generation: Awaitable[Any]) -> Any:
+    """Awaits a generation, cancelling it and raising GenerationAborted if the client disconnects first"""
+    task = asyncio.ensure_future(generation)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise GenerationAborted(StoryStatus.CANCELLED.value)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+async def _record_aborted_story(story_data: StoryCreate, user: User, error: GenerationAborted):
+    """Keeps a story record for a generation that timed out or was cancelled"""
+    story = await story_service.create_story(story_data, str(user.id), status=error.reason)
+    await story_service.update_story_status(str(story.id), str(user.id), error.reason, str(error))
+    logger.warning(f"Story generation {error.reason} for user {user.username}: {story.id}")
+
 async def get_current_user(authorization: str = Header(...)) -> User:
     """Dependency to get current user from JWT token"""
     if not authorization.startswith("Bearer "):
@@ -22,15 +84,16 @@ async def get_current_user(authorization: str = Header(...)) -> User:
         )
     
     token = authorization[7:]
-    payload = verify_token(token)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or expired token"
-        )
-    
-    user_id = payload.get("sub")
-    user = auth_service.get_user_by_id(user_id)
+    with timed("auth"):
+        payload = verify_token(token)
+        if not payload:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token"
+            )
+        
+        user_id = payload.get("sub")
+        user = auth_service.get_user_by_id(user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -42,41 +105,50 @@ async def get_current_user(authorization: str = Header(...)) -> User:
 @router.post("/generate", response_model=Dict[str, Any])
 async def generate_story(
     story_data: StoryCreate,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """
     Generate a new story using AI
     """
+    require_model_ready()
+    
+    # Prepare data for AI generation
+    generation_data = story_data.generation_data(str(current_user.id))
+    flight_key = generation_flights.make_key(str(current_user.id), generation_data, nlp_service.model_version)
+    
+    async def generate_content() -> str:
+        with timed("queue_wait"):
+            ticket = await acquire_generation_slot(current_user, story_data)
+        try:
+            return await nlp_service.generate_story(generation_data)
+        finally:
+            generation_queue.release(ticket)
+    
     try:
         logger.info(f"Generating story for user: {current_user.username}")
         
+        # Generate story content using AI; an identical request already in flight for this
+        # user (double-click, retry) shares its queue slot and model run
+        # "generation" spans queue_wait through clean; coalesced requests only get this total
+        with timed("generation"):
+            generated_content = await _until_disconnected(request, generation_flights.run(flight_key, generate_content))
+        logger.info(f"Story content generated, length: {len(generated_content)}")
+        
         # Create story in database
-        story = await story_service.create_story(story_data, str(current_user.id))
+        with timed("create_story"):
+            story = await story_service.create_story(story_data, str(current_user.id))
         logger.info(f"Story created with ID: {story.id}")
         
-        # Prepare data for AI generation
-        generation_data = {
-            "prompt": story_data.prompt,
-            "genre": story_data.genre.value,
-            "language": story_data.language.value,
-            "length": story_data.length.value,
-            "tone": story_data.tone.value if story_data.tone else "light_hearted",
-            "characters": story_data.characters,
-            "setting": story_data.setting
-        }
-        
-        # Generate story content using AI
-        generated_content = await nlp_service.generate_story(generation_data)
-        logger.info(f"Story content generated, length: {len(generated_content)}")
-        
         # Update story with generated content
         word_count = len(generated_content.split())
-        success = await story_service.update_story_content(
-            str(story.id), 
-            str(current_user.id), 
-            generated_content, 
-            word_count
-        )
+        with timed("save_story"):
+            success = await story_service.update_story_content(
+                str(story.id), 
+                str(current_user.id), 
+                generated_content, 
+                word_count
+            )
         
         if not success:
             logger.error(f"Failed to update story content for story: {story.id}")
@@ -86,7 +158,8 @@ async def generate_story(
             )
         
         # Get updated story
-        updated_story = await story_service.get_story_by_id(str(story.id), str(current_user.id))
+        with timed("fetch_story"):
+            updated_story = await story_service.get_story_by_id(str(story.id), str(current_user.id))
         
         if not updated_story:
             raise HTTPException(
@@ -115,6 +188,13 @@ async def generate_story(
         
     except HTTPException:
         raise
+    except GenerationAborted as e:
+        await _record_aborted_story(story_data, current_user, e)
+        timed_out = e.reason == StoryStatus.TIMED_OUT.value
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT if timed_out else HTTP_499_CLIENT_CLOSED_REQUEST,
+            detail="Story generation timed out" if timed_out else "Story generation cancelled"
+        )
     except Exception as e:
         logger.error(f"Story generation error: {str(e)}")
         raise HTTPException(
@@ -122,6 +202,165 @@ async def generate_story(
             detail="Internal server error during story generation"
         )
 
+@router.post("/generate/async", response_model=Dict[str, Any], status_code=status.HTTP_202_ACCEPTED)
+async def generate_story_async(
+    story_data: StoryCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Queue a story for background generation and return its ID immediately.
+    Poll GET /stories/{story_id} until its status is done or failed.
+    """
+    require_model_ready()
+    ticket = await acquire_generation_slot(current_user, story_data, wait=False)
+    try:
+        logger.info(f"Queueing story generation for user: {current_user.username}")
+        
+        # Create story in database
+        story = await story_service.create_story(story_data, str(current_user.id), status=StoryStatus.QUEUED.value)
+        logger.info(f"Story created with ID: {story.id}")
+        
+    except Exception as e:
+        generation_queue.release(ticket)
+        logger.error(f"Story queueing error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error during story generation"
+        )
+    
+    generation_jobs.submit(str(story.id), str(current_user.id), story_data.generation_data(str(current_user.id)), ticket)
+    
+    return {
+        "message": "Story generation queued",
+        "story": {
+            "id": str(story.id),
+            "title": story.title,
+            "status": story.status,
+            "created_at": story.created_at
+        }
+    }
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formats one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+@router.post("/generate/stream")
+async def generate_story_stream(
+    story_data: StoryCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Generate a new story using AI, streaming text chunks as server-sent events
+    """
+    require_model_ready()
+    ticket = await acquire_generation_slot(current_user, story_data)
+    try:
+        logger.info(f"Streaming story for user: {current_user.username}")
+        
+        # Create story in database
+        story = await story_service.create_story(story_data, str(current_user.id))
+        logger.info(f"Story created with ID: {story.id}")
+        
+    except Exception as e:
+        generation_queue.release(ticket)
+        logger.error(f"Story streaming error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error during story generation"
+        )
+    
+    # Prepare data for AI generation
+    generation_data = story_data.generation_data(str(current_user.id))
+    
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for chunk in _stream_events():
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away mid-stream; decoding was stopped along with it
+            await story_service.update_story_status(str(story.id), str(current_user.id), StoryStatus.CANCELLED.value, "Client disconnected")
+            raise
+        finally:
+            # The slot is held until the stream ends or the client goes away
+            generation_queue.release(ticket)
+    
+    async def _stream_events() -> AsyncIterator[str]:
+        yield _sse_event("story", {"id": str(story.id), "title": story.title})
+        
+        async for event in nlp_service.stream_story(generation_data):
+            if event["event"] == "token":
+                yield _sse_event("token", {"text": event["text"]})
+                continue
+            
+            if event["event"] == "error":
+                await story_service.update_story_status(
+                    str(story.id), 
+                    str(current_user.id), 
+                    event.get("reason", StoryStatus.FAILED.value), 
+                    event["message"]
+                )
+                yield _sse_event("error", {"message": event["message"]})
+                return
+            
+            # Persist the final cleaned story once generation has finished
+            content = event["content"]
+            word_count = len(content.split())
+            success = await story_service.update_story_content(
+                str(story.id), 
+                str(current_user.id), 
+                content, 
+                word_count
+            )
+            
+            if not success:
+                logger.error(f"Failed to update story content for story: {story.id}")
+                yield _sse_event("error", {"message": "Failed to save generated story"})
+                return
+            
+            yield _sse_event("done", {
+                "id": str(story.id),
+                "content": content,
+                "word_count": word_count,
+                "generated_tokens": event["generated_tokens"],
+                "time_to_first_token_ms": event["time_to_first_token_ms"],
+                "total_time_ms": event["total_time_ms"]
+            })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/similar", response_model=Dict[str, Any])
+async def find_similar_story(
+    story_data: StoryCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Offer one of the user's stories written for a near-identical request (same language,
+    genre, tone and length) before generating. Send reuse_similar with /generate to accept it.
+    """
+    if not semantic_index.enabled:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Similar story lookup is not enabled"
+        )
+    
+    try:
+        story = await semantic_index.offer(story_data.generation_data(str(current_user.id)))
+    except Exception as e:
+        logger.error(f"Similar story lookup error: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error"
+        )
+    
+    return {
+        "message": "Similar story found" if story else "No similar story found",
+        "story": story
+    }
+
 @router.get("/", response_model=Dict[str, Any])
 async def get_user_stories(
     current_user: User = Depends(get_current_user),
@@ -143,6 +382,7 @@ async def get_user_stories(
                     "language": story.language,
                     "length": story.length,
                     "word_count": story.word_count,
+                    "status": story.status,
                     "created_at": story.created_at
                 }
                 for story in stories
@@ -189,6 +429,9 @@ async def get_story(
                 "setting": story.setting,
                 "content": story.content,
                 "word_count": story.word_count,
+                "status": story.status,
+                "error": story.error,
+                "progress": generation_jobs.progress(story_id),
                 "is_favorite": story.is_favorite,
                 "created_at": story.created_at
             }
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List, Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -14,6 +14,8 @@ class Settings(BaseSettings):
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     RELOAD: bool = True
+    PREFORK_WORKERS: int = 2  # API workers forked by serve_prefork.py, sharing one model copy
+    PREFORK_METRICS_PORT: Optional[int] = None  # Worker i serves its own /metrics on this port + i
     
     # Database
     MONGODB_URI: str
@@ -32,8 +34,51 @@ class Settings(BaseSettings):
     HUGGINGFACE_API_KEY: Optional[str] = None
     NLP_API_MODEL: str = "google/gemma-7b-it"
     MODEL_CACHE_DIR: str = "./ml_models_cache"
-    MODEL_TIMEOUT_SECONDS: int = 60
+    MODEL_TIMEOUT_SECONDS: int = 300  # Decode deadline per generation; long stories on CPU take minutes
+    INFERENCE_PRECISION: str = "auto"  # auto, float32, bfloat16, float16 or int8_dynamic
+    SPECULATIVE_DRAFT_MODEL: Optional[str] = None  # Small model sharing the Gemma tokenizer
+    SPECULATIVE_NUM_DRAFT_TOKENS: int = 5
+    # eager, compile (torch.compile + static KV cache) or onnx (ONNX Runtime CPU, needs optimum[onnxruntime]).
+    # Non-eager backends run requests one at a time, without batching or the prefix KV cache.
+    INFERENCE_BACKEND: str = "eager"
+    MERGED_MODEL_CACHE_ENABLED: bool = True  # Persist the LoRA-merged model for fast cold starts
+    MERGED_MODEL_CACHE_DIR: Optional[str] = None  # Defaults to MODEL_CACHE_DIR/merged
+    # Extra unmerged LoRA adapters over the shared base model, keyed by "<language>" or
+    # "<language>_<genre>", e.g. {"hi": "./lora_hi", "te_comedy": "./lora_te_comedy"}
+    LORA_ADAPTERS: Dict[str, str] = {}
+    MODEL_WARMUP_GENERATIONS: int = 3  # Short generations run after loading, before reporting ready
+    MODEL_WARMUP_MAX_NEW_TOKENS: int = 16
+    # Per-language max_new_tokens written by calibrate_token_budgets.py; defaults to MODEL_CACHE_DIR/token_budgets.json
+    TOKEN_BUDGETS_PATH: Optional[str] = None
+    TOKEN_BUDGET_MAX_NEW_TOKENS: int = 4096  # Upper bound for calibrated budgets (prompt + story must fit the context)
     
+    # Multi-replica inference (process per replica, pinned to its own cores)
+    INFERENCE_REPLICAS: int = 1
+    INFERENCE_THREADS_PER_REPLICA: Optional[int] = None  # Defaults to available cores // replicas
+
+    # Generation Batching
+    GENERATION_BATCHING_ENABLED: bool = True
+    GENERATION_MAX_BATCH_SIZE: int = 8
+    GENERATION_MAX_WAIT_MS: int = 25
+    PREFIX_CACHE_ENABLED: bool = True
+
+    # Generation Admission Control
+    GENERATION_MAX_CONCURRENT: int = 8
+    GENERATION_QUEUE_MAX_DEPTH: int = 32
+    GENERATION_MAX_PER_USER: int = 2
+    GENERATION_QUEUE_AGING_SECONDS: int = 30
+
+    # Deterministic Generation Cache
+    GENERATION_CACHE_MAX_ENTRIES: int = 1024
+    GENERATION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    GENERATION_CACHE_DB_RETRY_SECONDS: int = 60  # MongoDB tier is skipped this long after a failed call
+
+    # Near-duplicate Story Reuse (embedding index over stored prompts)
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # Cosine similarity a stored prompt needs to be reused
+    SEMANTIC_CACHE_AUTO_REUSE: bool = False  # Reuse for every unseeded request, not only those sent with reuse_similar
+
     # CORS
     CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://127.0.0.1:3000"]
     
@@ -1,5 +1,6 @@
 from pymongo import MongoClient
 from app.core.config import settings
+from app.core.metrics import mongo_command_metrics
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +12,7 @@ class Database:
     
     def connect(self):
         try:
-            self.client = MongoClient(settings.MONGODB_URI)
+            self.client = MongoClient(settings.MONGODB_URI, event_listeners=[mongo_command_metrics])
             self.db = self.client[settings.DATABASE_NAME]
             # Test connection
             self.client.admin.command('ping')
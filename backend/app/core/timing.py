@@ -0,0 +1,104 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_timer: ContextVar[Optional["RequestTimer"]] = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Stage durations and token counts collected while one request is served."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.first_token_at: Optional[float] = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name: str, value: int):
+        self.counts[name] = value
+
+    def mark_first_token(self):
+        """Called from the decoding thread when the request's first token is sampled."""
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def split_generation(self, started_at: float, finished_at: float):
+        """Records prefill (up to the first token, including batch wait) and decode for one generation."""
+        if self.first_token_at is None:
+            self.add("generate", finished_at - started_at)
+            return
+        self.add("prefill", self.first_token_at - started_at)
+        self.add("decode", finished_at - self.first_token_at)
+
+    def server_timing(self) -> str:
+        metrics = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in self.stages.items()]
+        metrics += [f'{name};desc="{value}"' for name, value in self.counts.items()]
+        metrics.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(metrics)
+
+    def as_dict(self) -> Dict[str, float]:
+        result = {f"{stage}_ms": round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        result.update(self.counts)
+        result["total_ms"] = round((time.perf_counter() - self.started_at) * 1000, 1)
+        return result
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current_timer.get()
+
+
+@contextmanager
+def timed(stage: str):
+    """Adds the duration of the block to the current request's timer; a no-op outside timed requests."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(stage, time.perf_counter() - started_at)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that times requests to the given paths: each gets a RequestTimer,
+    its stages are returned in a Server-Timing header and logged as one JSON line.
+    """
+
+    def __init__(self, app, paths: Iterable[str]):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+        status_code = None
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timer.server_timing().encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timer.reset(token)
+            logger.info(f"⏱️ request_timing {json.dumps({'method': scope['method'], 'path': scope['path'], 'status': status_code, **timer.as_dict()})}")
@@ -1,12 +1,21 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import logging
+import time
 import uvicorn
 
 from app.core.config import settings
 from app.core.database import db
+from app.core.timing import ServerTimingMiddleware
+from app.core.metrics import MetricsMiddleware, render_metrics
 from app.services.nlp_service import nlp_service
+from app.services.generation_queue import generation_queue
+from app.services.generation_jobs import generation_jobs
+from app.services.generation_flights import generation_flights
+from app.services.token_budgets import token_budgets
+from app.services.semantic_cache import semantic_index
 from app.api import api_router
 
 # Configure logging
@@ -16,6 +25,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+STARTED_AT = time.monotonic()
+
 # In the lifespan function, update the NLP service initialization:
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -34,18 +45,18 @@ async def lifespan(app: FastAPI):
         pass
         
     # 2. NLP Service Initialization (Model Loading)
-    try:
-        # Initialize NLP service (this will load all models, including LoRA if present)
-        await nlp_service.initialize()
-        logger.info("✅ StoryGenie AI models loaded successfully.")
-        
-    except Exception as e:
-        logger.error(f"❌ AI Model Loading failed: {e}")
-        logger.info("❌ StoryGenie starting without AI generation capabilities. Check Hugging Face key or memory.")
+    # Models load and warm up in the background; auth and history routes serve immediately
+    # and /health/ready reports when story generation is available.
+    nlp_service.start_background_initialize()
+    
+    # 3. Near-duplicate story index (embeds stored prompts in the background when enabled)
+    semantic_index.start_background_build()
 
     yield
     
     # Shutdown
+    await generation_jobs.close()
+    semantic_index.close()
     db.close()
     await nlp_service.close()
     logger.info("✅ StoryGenie shutdown complete")
@@ -69,6 +80,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Stage timings for generation requests, returned as Server-Timing and logged per request
+app.add_middleware(ServerTimingMiddleware, paths=["/api/v1/stories/generate"])
+
+# Per-route latency histograms, exposed with the other metrics on /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include API routes
 app.include_router(api_router, prefix="/api/v1")
 
@@ -85,11 +102,43 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy" if db.client and nlp_service.is_initialized else "degraded",
+        "status": "healthy" if db.client and nlp_service.is_ready else "degraded",
         "database": "connected" if db.client else "disconnected",
-        "nlp_service": "ready" if nlp_service.is_initialized else "failed_to_load"
+        "nlp_service": nlp_service.load_state,
+        "generation_queue": generation_queue.stats(),
+        "request_coalescing": generation_flights.stats(),
+        "early_stopping": nlp_service.stopping_stats(),
+        "token_budgets": token_budgets.stats(),
+        "semantic_cache": semantic_index.stats(),
+        "prompt_templates": nlp_service.template_stats()
+    }
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint (text exposition format)"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe: the process is up and the event loop is responsive"""
+    return {
+        "status": "alive",
+        "uptime_seconds": round(time.monotonic() - STARTED_AT, 2)
     }
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe: 200 once the database is connected and the models are loaded and warmed up"""
+    ready = bool(db.client) and nlp_service.is_ready
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "database": "connected" if db.client else "disconnected",
+            "nlp_service": nlp_service.load_status()
+        }
+    )
+
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Any, Dict, Optional, List
 from datetime import datetime
 from enum import Enum
 
@@ -30,6 +30,14 @@ class Tone(str, Enum):
     DARK = "dark"
     SERIOUS = "serious"
 
+class StoryStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+    CANCELLED = "cancelled"
+
 class Story(BaseModel):
     id: Optional[str] = None
     user_id: str
@@ -43,6 +51,8 @@ class Story(BaseModel):
     setting: Optional[str] = None
     content: str
     word_count: int
+    status: str = StoryStatus.DONE.value  # Stories created before background jobs existed are done
+    error: Optional[str] = None
     is_favorite: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -55,6 +65,25 @@ class StoryCreate(BaseModel):
     tone: Optional[Tone] = None
     characters: Optional[List[str]] = None
     setting: Optional[str] = None
+    seed: Optional[int] = Field(None, ge=0)  # Opt-in deterministic generation, served from cache when repeated
+    reuse_similar: bool = False  # Accept an existing story written for a near-identical prompt instead of generating
+
+    def generation_data(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Prepare data for AI generation; user_id scopes near-duplicate reuse to the requester's stories"""
+        data = {
+            "prompt": self.prompt,
+            "genre": self.genre.value,
+            "language": self.language.value,
+            "length": self.length.value,
+            "tone": self.tone.value if self.tone else "light_hearted",
+            "characters": self.characters,
+            "setting": self.setting,
+            "seed": self.seed,
+            "reuse_similar": self.reuse_similar
+        }
+        if user_id:
+            data["user_id"] = user_id
+        return data
 
 class StoryResponse(BaseModel):
     id: str
@@ -10,8 +10,10 @@ from app.models.user import User, UserCreate, UserLogin, UserResponse
 logger = logging.getLogger(__name__)
 
 class AuthService:
-    def __init__(self):
-        self.users_collection = db.get_collection("users")
+    # Resolved on use, so importing the service does not connect to the database
+    @property
+    def users_collection(self):
+        return db.get_collection("users")
     
     def create_user(self, user_data: UserCreate) -> User:
         try:
@@ -0,0 +1,43 @@
+import time
+from typing import Callable, List, Optional
+
+
+class GenerationAborted(Exception):
+    """Raised when a generation stops before finishing; reason is "timed_out" or "cancelled"."""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"Generation {reason.replace('_', ' ')}")
+
+
+class CancelToken:
+    """
+    Cooperative cancellation for one generation, checked once per decode step. It aborts
+    when its deadline (MODEL_TIMEOUT_SECONDS) passes or when cancel() is called because
+    nobody is waiting for the result any more.
+    """
+
+    def __init__(self, timeout_seconds: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout_seconds if timeout_seconds else None
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+
+    def cancel(self):
+        if self.reason is None:
+            self.reason = "cancelled"
+            for callback in self._callbacks:
+                callback()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Registers a callback run by cancel(), e.g. to forward it to a replica process."""
+        self._callbacks.append(callback)
+
+    @property
+    def aborted(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = "timed_out"
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None without one."""
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from app.core.config import settings
+from app.core.database import db
+
+logger = logging.getLogger(__name__)
+
+class GenerationCache:
+    """
+    Cache of finished stories for seeded (deterministic) generation requests.
+    An in-process LRU with TTL sits in front of a MongoDB collection, so repeated
+    requests are served from memory and survive restarts / other API workers.
+    MongoDB is only used from a worker thread and skipped for retry_seconds after a
+    failure, so an unreachable database never stalls the event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, retry_seconds: int):
+        self._collection = None
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        # Offline tools without a database turn the MongoDB tier off entirely
+        self.persistent = True
+        self._db_retry_at = 0.0
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="generation-cache")
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache_collection(self):
+        # Resolved lazily so the NLP service can be imported without a database
+        if self._collection is None:
+            collection = db.get_collection("generation_cache")
+            try:
+                # MongoDB's TTL monitor removes expired documents in the background
+                collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not create TTL index on generation cache: {e}")
+            self._collection = collection
+        return self._collection
+
+    @staticmethod
+    def make_key(story_data: Dict[str, Any], model_version: str, precision: str = "", backend: str = "") -> str:
+        """
+        Hashes the normalized request so trivially different spellings share one entry.
+        Precision and inference backend are part of the key: the same seed samples different
+        text in int8 and bfloat16.
+        """
+        def normalize(text: Optional[str]) -> str:
+            return " ".join((text or "").split())
+
+        key_fields = [
+            normalize(story_data.get("prompt")),
+            story_data.get("language"),
+            story_data.get("genre"),
+            story_data.get("tone") or "light_hearted",
+            story_data.get("length"),
+            [normalize(c) for c in story_data.get("characters") or [] if normalize(c)],
+            normalize(story_data.get("setting")),
+            model_version,
+            precision,
+            backend,
+            story_data.get("seed"),
+        ]
+        encoded = json.dumps(key_fields, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, content = entry
+                if now - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return content
+                del self._entries[key]
+
+        document = None
+        if self._db_available():
+            document = await asyncio.get_running_loop().run_in_executor(self.executor, self._find_sync, key)
+
+        # The TTL monitor only runs periodically, so expired documents may still be found
+        if document and datetime.utcnow() - document["created_at"] < timedelta(seconds=self.ttl_seconds):
+            self._remember(key, document["content"])
+            with self._lock:
+                self.hits += 1
+            return document["content"]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, content: str):
+        """Stores in memory now; the MongoDB write runs in the background."""
+        self._remember(key, content)
+        if self._db_available():
+            self.executor.submit(self._store_sync, key, content)
+
+    def _db_available(self) -> bool:
+        return self.persistent and time.monotonic() >= self._db_retry_at
+
+    def _db_failed(self, action: str, error: Exception):
+        self._db_retry_at = time.monotonic() + self.retry_seconds
+        logger.error(f"Error {action} generation cache: {str(error)}. Skipping MongoDB for {self.retry_seconds}s.")
+
+    def _find_sync(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.cache_collection.find_one({"_id": key})
+        except Exception as e:
+            self._db_failed("reading", e)
+            return None
+
+    def _store_sync(self, key: str, content: str):
+        try:
+            self.cache_collection.update_one(
+                {"_id": key},
+                {"$set": {"content": content, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            self._db_failed("writing", e)
+
+    def _remember(self, key: str, content: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), content)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# Global instance
+generation_cache = GenerationCache(
+    max_entries=settings.GENERATION_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.GENERATION_CACHE_TTL_SECONDS,
+    retry_seconds=settings.GENERATION_CACHE_DB_RETRY_SECONDS
+)
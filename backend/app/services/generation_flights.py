@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from app.services.generation_cache import GenerationCache
+
+logger = logging.getLogger(__name__)
+
+class GenerationFlights:
+    """
+    Single-flight coalescing of identical generation requests. While a generation for a
+    user's normalized payload is in flight, later identical requests from the same user
+    await its result instead of running the model again (double-clicks, client retries).
+    The generation is cancelled only once every caller waiting for it has gone away.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(user_id: str, generation_data: Dict[str, Any], model_version: str) -> str:
+        return f"{user_id}:{GenerationCache.make_key(generation_data, model_version)}"
+
+    async def run(self, key: str, generate: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the result of the in-flight generation for key, starting it if there is none."""
+        task = self._flights.get(key)
+        if task is None:
+            # The generation runs as its own task, so a caller that goes away does not cancel it for the others
+            task = asyncio.ensure_future(generate())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._land(key, done))
+            self.started += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"🔗 Coalesced duplicate generation request ({self.coalesced} so far)")
+        
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _land(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        # Mark the error as retrieved even if every caller went away before it finished
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "started": self.started, "coalesced": self.coalesced}
+
+# Global instance
+generation_flights = GenerationFlights()
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Set
+
+from app.models.story import StoryStatus
+from app.services.generation_queue import generation_queue, GenerationTicket
+from app.services.nlp_service import nlp_service
+from app.services.story_service import story_service
+
+logger = logging.getLogger(__name__)
+
+class GenerationJobService:
+    """
+    Runs story generations as background tasks so the API can answer right away.
+    The story document's status moves queued -> running -> done/failed/timed_out; while a job
+    runs in this process its partial progress is kept in memory for polling.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self._progress: Dict[str, Dict[str, Any]] = {}
+
+    def submit(self, story_id: str, user_id: str, generation_data: Dict[str, Any], ticket: GenerationTicket):
+        task = asyncio.create_task(self._run(story_id, user_id, generation_data, ticket))
+        # Keep a reference so the task is not garbage collected while it runs
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def progress(self, story_id: str) -> Optional[Dict[str, Any]]:
+        return self._progress.get(story_id)
+
+    async def _run(self, story_id: str, user_id: str, generation_data: Dict[str, Any], ticket: GenerationTicket):
+        try:
+            await generation_queue.wait(ticket)
+            await story_service.update_story_status(story_id, user_id, StoryStatus.RUNNING.value)
+            progress = self._progress[story_id] = {"generated_characters": 0}
+
+            async for event in nlp_service.stream_story(generation_data):
+                if event["event"] == "token":
+                    progress["generated_characters"] += len(event["text"])
+                elif event["event"] == "error":
+                    await story_service.update_story_status(story_id, user_id, event.get("reason", StoryStatus.FAILED.value), event["message"])
+                    return
+                else:
+                    content = event["content"]
+                    success = await story_service.update_story_content(story_id, user_id, content, len(content.split()))
+                    if not success:
+                        await story_service.update_story_status(story_id, user_id, StoryStatus.FAILED.value, "Failed to save generated story")
+                    logger.info(f"Background generation finished for story: {story_id}")
+
+        except asyncio.CancelledError:
+            await story_service.update_story_status(story_id, user_id, StoryStatus.FAILED.value, "Generation interrupted by server shutdown")
+            raise
+        except Exception as e:
+            logger.error(f"Background generation failed for story {story_id}: {str(e)}")
+            await story_service.update_story_status(story_id, user_id, StoryStatus.FAILED.value, "Internal error during story generation")
+        finally:
+            generation_queue.release(ticket)
+            self._progress.pop(story_id, None)
+
+    async def close(self):
+        """Cancels running jobs; their stories are marked failed."""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Global instance
+generation_jobs = GenerationJobService()
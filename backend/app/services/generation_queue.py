@@ -0,0 +1,190 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+from typing import Dict, Any, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import Gauge
+from app.models.story import Length
+
+logger = logging.getLogger(__name__)
+
+# Shortest job first: lower rank is dispatched earlier
+LENGTH_RANK = {Length.SHORT.value: 0, Length.MEDIUM.value: 1, Length.LONG.value: 2}
+
+# Initial service time estimates (seconds) until real generations have been observed
+DEFAULT_SERVICE_SECONDS = {Length.SHORT.value: 30.0, Length.MEDIUM.value: 50.0, Length.LONG.value: 70.0}
+
+class GenerationQueueFull(Exception):
+    """Raised when a generation request cannot be admitted; carries a Retry-After estimate."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class GenerationTicket:
+    def __init__(self, user_id: str, length: str, seq: int):
+        self.user_id = user_id
+        self.length = length
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+        self.released = False
+
+class GenerationQueue:
+    """
+    Bounded admission queue in front of story generation. At most max_concurrent generations
+    run at once, each user may hold max_per_user running or queued requests, and waiting
+    requests are dispatched shortest-job-first by Length. Waiting jobs gain one rank every
+    aging_seconds, so long stories cannot be starved by a steady stream of short ones.
+    """
+
+    def __init__(self, max_concurrent: int, max_depth: int, max_per_user: int, aging_seconds: int):
+        self.max_concurrent = max_concurrent
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.aging_seconds = max(1, aging_seconds)
+        self._waiting: List[GenerationTicket] = []
+        self._running = 0
+        self._per_user: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._service_seconds = dict(DEFAULT_SERVICE_SECONDS)
+        self.admitted = 0
+        self.rejected = 0
+        self.started = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    async def acquire(self, user_id: str, length: str) -> GenerationTicket:
+        """Waits for a generation slot. Raises GenerationQueueFull instead of queueing unboundedly."""
+        ticket = self.admit(user_id, length)
+        try:
+            await self.wait(ticket)
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+        return ticket
+
+    def admit(self, user_id: str, length: str) -> GenerationTicket:
+        """
+        Admits a request without waiting: the ticket either holds a slot already or is queued.
+        Raises GenerationQueueFull when the user or the queue is at its limit.
+        """
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            self.rejected += 1
+            raise GenerationQueueFull(
+                f"You already have {self.max_per_user} stories being generated. Please wait for one to finish.",
+                self._estimate_seconds([length])
+            )
+        if self._running >= self.max_concurrent and len(self._waiting) >= self.max_depth:
+            self.rejected += 1
+            raise GenerationQueueFull(
+                "Story generation is at capacity. Please try again shortly.",
+                self.retry_after(length)
+            )
+
+        ticket = GenerationTicket(user_id, length, next(self._seq))
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self.admitted += 1
+
+        if self._running < self.max_concurrent and not self._waiting:
+            self._start(ticket)
+            return ticket
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._waiting.append(ticket)
+        return ticket
+
+    async def wait(self, ticket: GenerationTicket):
+        """Waits until an admitted ticket has been dispatched."""
+        if ticket.future is not None:
+            await ticket.future
+
+    def release(self, ticket: GenerationTicket):
+        """Frees whatever the ticket holds (a slot or a queue position) and dispatches the next request."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+            self._forget_user(ticket.user_id)
+            return
+
+        self._running -= 1
+        self._forget_user(ticket.user_id)
+        if ticket.started_at is not None:
+            # Exponentially weighted average keeps the Retry-After estimate current
+            elapsed = time.monotonic() - ticket.started_at
+            previous = self._service_seconds.get(ticket.length, elapsed)
+            self._service_seconds[ticket.length] = 0.8 * previous + 0.2 * elapsed
+        self._dispatch()
+
+    def retry_after(self, length: str) -> int:
+        """Seconds until a new request of this length would likely get a slot."""
+        return self._estimate_seconds([t.length for t in self._waiting] + [length])
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "running": self._running,
+            "queued": len(self._waiting),
+            "max_concurrent": self.max_concurrent,
+            "max_depth": self.max_depth,
+            "queued_by_length": {
+                length: sum(1 for t in self._waiting if t.length == length) for length in LENGTH_RANK
+            },
+            "oldest_wait_seconds": round(max((now - t.enqueued_at for t in self._waiting), default=0.0), 2),
+            "avg_wait_seconds": round(self.total_wait_seconds / self.started, 2) if self.started else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 2),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._running < self.max_concurrent and self._waiting:
+            ticket = min(self._waiting, key=lambda t: (self._priority(t, now), t.seq))
+            self._waiting.remove(ticket)
+            self._start(ticket)
+            if not ticket.future.done():
+                ticket.future.set_result(None)
+
+    def _priority(self, ticket: GenerationTicket, now: float) -> int:
+        waited = now - ticket.enqueued_at
+        return LENGTH_RANK.get(ticket.length, 1) - int(waited // self.aging_seconds)
+
+    def _start(self, ticket: GenerationTicket):
+        self._running += 1
+        self.started += 1
+        ticket.started_at = time.monotonic()
+        waited = ticket.started_at - ticket.enqueued_at
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        if waited >= 1:
+            logger.info(f"⏳ {ticket.length} generation waited {waited:.1f}s in queue ({len(self._waiting)} still queued)")
+
+    def _forget_user(self, user_id: str):
+        remaining = self._per_user.get(user_id, 0) - 1
+        if remaining > 0:
+            self._per_user[user_id] = remaining
+        else:
+            self._per_user.pop(user_id, None)
+
+    def _estimate_seconds(self, lengths: List[str]) -> int:
+        backlog = sum(self._service_seconds.get(length, DEFAULT_SERVICE_SECONDS[Length.MEDIUM.value]) for length in lengths)
+        return max(1, math.ceil(backlog / self.max_concurrent))
+
+# Global instance
+generation_queue = GenerationQueue(
+    max_concurrent=settings.GENERATION_MAX_CONCURRENT,
+    max_depth=settings.GENERATION_QUEUE_MAX_DEPTH,
+    max_per_user=settings.GENERATION_MAX_PER_USER,
+    aging_seconds=settings.GENERATION_QUEUE_AGING_SECONDS
+)
+
+# Read at scrape time, so admission and release do no extra bookkeeping
+Gauge("storygenie_generations_in_flight", "Generations holding a slot", callback=lambda: generation_queue._running)
+Gauge("storygenie_generations_queued", "Generations waiting for a slot", callback=lambda: len(generation_queue._waiting))
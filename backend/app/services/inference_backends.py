@@ -0,0 +1,120 @@
+import logging
+import os
+import shutil
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBackend:
+    """
+    Runs model.generate for the unbatched generation path. The eager backend is the plain
+    PyTorch model, which the continuous batch scheduler and prefix KV cache also drive
+    directly; other backends own their execution and opt out of both.
+    """
+
+    name = "eager"
+    supports_batching = True
+    supports_prefix_cache = True
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def device(self) -> torch.device:
+        return self.model.device
+
+    def generate(self, inputs: torch.Tensor, **generation_kwargs) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model.generate(inputs, **generation_kwargs)
+
+
+class CompiledBackend(InferenceBackend):
+    """
+    torch.compile'd forward with a static KV cache. The cache tensors keep one shape for the
+    whole generation, so the single-token decode step compiles once and is reused; the
+    prefill is recompiled once with a dynamic length the first time the prompt length changes.
+    """
+
+    name = "compile"
+    supports_batching = False
+    supports_prefix_cache = False
+
+    def __init__(self, model):
+        super().__init__(model)
+        model.generation_config.cache_implementation = "static"
+        model.forward = torch.compile(model.forward)
+
+    def generate(self, inputs: torch.Tensor, **generation_kwargs) -> torch.Tensor:
+        # A DynamicCache prefix cannot seed the static cache
+        generation_kwargs.pop("past_key_values", None)
+        return super().generate(inputs, cache_implementation="static", **generation_kwargs)
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX Runtime on CPU, running an exported copy of the loaded (LoRA-merged) model.
+    The export is cached per model version, so it only happens once per adapter change.
+    Requires the optional optimum[onnxruntime] dependency.
+    """
+
+    name = "onnx"
+    supports_batching = False
+    supports_prefix_cache = False
+
+    def __init__(self, model, export_dir: str):
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImportError("INFERENCE_BACKEND=onnx requires: pip install optimum[onnxruntime]") from e
+
+        if not os.path.isdir(export_dir):
+            self._export(model, export_dir, ORTModelForCausalLM)
+        started_at = time.perf_counter()
+        super().__init__(ORTModelForCausalLM.from_pretrained(export_dir, provider="CPUExecutionProvider", use_cache=True))
+        logger.info(f"✅ Loaded ONNX model from {export_dir} in {time.perf_counter() - started_at:.1f}s")
+
+    @staticmethod
+    def _export(model, export_dir: str, ort_model_class):
+        started_at = time.perf_counter()
+        staging_dir = f"{export_dir}.tmp-{os.getpid()}"
+        weights_dir = os.path.join(staging_dir, "torch")
+        try:
+            model.save_pretrained(weights_dir, safe_serialization=True)
+            ort_model = ort_model_class.from_pretrained(weights_dir, export=True, provider="CPUExecutionProvider", use_cache=True)
+            ort_model.save_pretrained(os.path.join(staging_dir, "onnx"))
+            # Another replica may have finished the same export first
+            if not os.path.isdir(export_dir):
+                os.replace(os.path.join(staging_dir, "onnx"), export_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        logger.info(f"💾 Exported ONNX model to {export_dir} in {time.perf_counter() - started_at:.1f}s")
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    def generate(self, inputs: torch.Tensor, **generation_kwargs) -> torch.Tensor:
+        generation_kwargs.pop("past_key_values", None)
+        return super().generate(inputs, **generation_kwargs)
+
+
+BACKENDS = {backend.name: backend for backend in (InferenceBackend, CompiledBackend, OnnxBackend)}
+
+
+def create_backend(name: str, model, cache_dir: str, model_version: str) -> InferenceBackend:
+    """Builds the configured backend, falling back to eager execution if it cannot be set up."""
+    name = (name or "eager").lower()
+    if name not in BACKENDS:
+        logger.warning(f"⚠️ Unknown inference backend '{name}'. Using eager.")
+        return InferenceBackend(model)
+    try:
+        if name == "onnx":
+            safe_version = model_version.strip("/").replace("/", "--").replace("@", "-").replace(":", "-").replace("+", "-")
+            return OnnxBackend(model, os.path.join(cache_dir, "onnx", safe_version))
+        return BACKENDS[name](model)
+    except Exception as e:
+        logger.error(f"❌ Failed to set up the {name} inference backend: {e}. Falling back to eager.")
+        return InferenceBackend(model)
@@ -4,16 +4,36 @@ import asyncio
 import torch
 from transformers import (
     AutoModelForCausalLM, AutoTokenizer,
-    AutoConfig,
+    AutoConfig, DynamicCache, LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor, StoppingCriteria, StoppingCriteriaList,
+    TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper,
 )
+from transformers.generation.streamers import BaseStreamer
 from transformers.pipelines import Pipeline as PipelineClass
 from peft import PeftModel
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+import hashlib
+import itertools
 import os
+import re
+import shutil
+import threading
+import time
 import traceback
 
 from app.core.config import settings
+from app.models.story import Genre, Language, Length, Tone
+from app.services.generation_cache import generation_cache
+from app.services.replica_pool import ReplicaPool
+from app.services.story_cleaner import StoryCleaner, END_MARKERS
+from app.services.inference_backends import InferenceBackend, create_backend
+from app.services.cancellation import CancelToken, GenerationAborted
+from app.services.token_budgets import WORD_BUDGETS, token_budgets
+from app.services.semantic_cache import semantic_index
+from app.core.timing import RequestTimer, current_timer, timed
+from app.core.metrics import GENERATION_DURATION, GENERATION_TOKENS_PER_SECOND, GENERATIONS, LORA_MERGE_SECONDS, MODEL_LOAD_SECONDS
 
 logger = logging.getLogger(__name__)
 
@@ -21,20 +41,87 @@ logger = logging.getLogger(__name__)
 LORA_WEIGHTS_PATH = os.environ.get("LORA_WEIGHTS_PATH", "./lora_storygenie_weights")
 
 
-# --- Helper function for synchronous (blocking) model loading ---
-def _load_model_sync(config: Dict[str, Any], cache_dir: str):
+def _adapter_fingerprint(path: str) -> str:
+    """Short content hash of the LoRA adapter files, used to version cached generations."""
+    if not os.path.isdir(path):
+        return "no-adapter"
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        if name.startswith("adapter_"):
+            digest.update(name.encode("utf-8"))
+            with open(os.path.join(path, name), "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+# --- Pre-merged LoRA checkpoints ---
+def _merged_checkpoint_dir(model_name: str, model_config, dtype: torch.dtype) -> str:
     """
-    Synchronous function to load tokenizer, base model (Gemma 2B), 
-    and conditionally apply LoRA weights for inference.
+    Location of the LoRA-merged checkpoint for this base revision, adapter and dtype.
+    Any change to the adapter files or the base model revision yields a new directory.
     """
-    model_name = config['model_name']
-    
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    dtype = torch.float16
-        
-    logging.info(f"Loading model on {device} with dtype={dtype}")
+    revision = getattr(model_config, "_commit_hash", None) or "unknown-revision"
+    key = hashlib.sha256(
+        f"{model_name}|{revision}|{_adapter_fingerprint(LORA_WEIGHTS_PATH)}|{dtype}".encode("utf-8")
+    ).hexdigest()[:16]
+    root = settings.MERGED_MODEL_CACHE_DIR or os.path.join(settings.MODEL_CACHE_DIR, "merged")
+    return os.path.join(root, f"{model_name.strip('/').replace('/', '--')}-{key}")
 
-    # 1. Load Tokenizer
+
+def _save_merged_checkpoint(model, path: str):
+    """Writes the merged model as safetensors; the directory only appears once it is complete."""
+    staging_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        model.save_pretrained(staging_path, safe_serialization=True)
+        os.replace(staging_path, path)
+        logger.info(f"💾 Saved merged LoRA checkpoint to {path}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not save merged LoRA checkpoint: {e}")
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+
+# --- Inference precision profiles ---
+PRECISION_PROFILES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+    # Weights are loaded and merged in float32, then Linear layers are quantized to int8
+    "int8_dynamic": torch.float32,
+}
+
+
+def _resolve_precision(device: str, precision: Optional[str] = None) -> str:
+    """
+    Maps the configured INFERENCE_PRECISION to a concrete profile for this device.
+    "auto" keeps float16 on GPU but uses float32 on CPU, where fp16 matmuls are emulated.
+    """
+    profile = (precision or settings.INFERENCE_PRECISION).lower()
+    if profile == "auto":
+        return "float16" if device == "cuda" else "float32"
+    if profile not in PRECISION_PROFILES:
+        logger.warning(f"⚠️ Unknown inference precision '{profile}'. Falling back to auto.")
+        return _resolve_precision(device, "auto")
+    if profile == "int8_dynamic" and device == "cuda":
+        logger.warning("⚠️ Dynamic int8 quantization is CPU-only. Using float16 on GPU.")
+        return "float16"
+    return profile
+
+
+def _quantize_dynamic_int8(model):
+    """Applies torch dynamic int8 quantization to the decoder's Linear layers."""
+    # lm_head stays in float32: it is tied to the embedding matrix and drives the final logits
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and name != "lm_head"
+    }
+    return torch.ao.quantization.quantize_dynamic(model, qconfig_spec, dtype=torch.qint8)
+
+
+# --- Helper function for synchronous (blocking) model loading ---
+def _load_tokenizer_sync(model_name: str, cache_dir: str):
     tokenizer = AutoTokenizer.from_pretrained(
         model_name,
         cache_dir=cache_dir,
@@ -45,9 +132,43 @@ def _load_model_sync(config: Dict[str, Any], cache_dir: str):
         tokenizer.pad_token = tokenizer.eos_token
         
     tokenizer.padding_side = "left"
+    return tokenizer
+
+
+def _load_model_sync(config: Dict[str, Any], cache_dir: str, precision: Optional[str] = None, apply_lora: bool = True, adapters: Optional[Dict[str, str]] = None):
+    """
+    Synchronous function to load tokenizer, base model (Gemma 2B), 
+    and conditionally apply LoRA weights for inference.
+    When adapters are given, they are attached unmerged as named PEFT adapters instead.
+    """
+    model_name = config['model_name']
+    started_at = time.perf_counter()
+    
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    precision = _resolve_precision(device, precision)
+    dtype = PRECISION_PROFILES[precision]
+        
+    logger.info(f"🧮 Inference precision profile: {precision} (loading on {device} with dtype={dtype})")
+
+    # 1. Load Tokenizer
+    tokenizer = _load_tokenizer_sync(model_name, cache_dir)
 
     # 2. Load Base Model (Gemma 2B)
-    model_config = AutoConfig.from_pretrained(model_name)
+    model_config = AutoConfig.from_pretrained(model_name, cache_dir=cache_dir, token=settings.HUGGINGFACE_API_KEY)
+    
+    use_lora = apply_lora and not adapters and os.path.isdir(LORA_WEIGHTS_PATH)
+    merged_path = None
+    if use_lora and settings.MERGED_MODEL_CACHE_ENABLED:
+        merged_path = _merged_checkpoint_dir(model_name, model_config, dtype)
+        if os.path.isdir(merged_path):
+            # safetensors shards are memory-mapped, so this skips the PEFT wrap and merge entirely
+            model = AutoModelForCausalLM.from_pretrained(
+                merged_path,
+                torch_dtype=dtype,
+                low_cpu_mem_usage=True
+            )
+            logger.info(f"⚡ Loaded pre-merged LoRA checkpoint from {merged_path} in {time.perf_counter() - started_at:.1f}s")
+            return _finish_model_load(model, tokenizer, device, precision, started_at, source="merged checkpoint")
     
     base_model = AutoModelForCausalLM.from_pretrained(
         model_name,
@@ -61,30 +182,770 @@ def _load_model_sync(config: Dict[str, Any], cache_dir: str):
     
     # 3. LoRA Fine-Tuning Integration
     model = base_model
-    if os.path.exists(LORA_WEIGHTS_PATH) and os.path.isdir(LORA_WEIGHTS_PATH):
+    source = "base model"
+    if not apply_lora:
+        logger.info(f"Using {model_name} without LoRA weights.")
+    elif adapters:
+        model = _attach_adapters(base_model, adapters)
+        if precision == "int8_dynamic":
+            # Quantizing would swap out the Linear layers the unmerged adapters are attached to
+            logger.warning("⚠️ Dynamic int8 quantization is not supported with multiple LoRA adapters. Using float32.")
+            precision = "float32"
+        return _finish_model_load(model, tokenizer, device, precision, started_at, source=f"base model + {len(adapters)} LoRA adapters")
+    elif use_lora:
         logger.info(f"💾 Found LoRA weights at {LORA_WEIGHTS_PATH}. Applying fine-tuning...")
         try:
+            merge_started_at = time.perf_counter()
             model = PeftModel.from_pretrained(base_model, LORA_WEIGHTS_PATH, is_trainable=False)
             model = model.merge_and_unload()
             logger.info("✅ LoRA weights merged into model successfully.")
+            source = "base model + LoRA merge"
+            if merged_path:
+                _save_merged_checkpoint(model, merged_path)
+            LORA_MERGE_SECONDS.set(time.perf_counter() - merge_started_at)
         except Exception as e:
             logger.error(f"❌ Failed to load and merge LoRA weights: {e}. Falling back to base model.")
+            if isinstance(model, PeftModel):
+                # The adapter layers were injected before the merge failed; remove them unmerged
+                model = model.unload()
+            source = "base model (LoRA merge failed)"
     else:
         logger.warning(f"⚠️ LoRA weights not found at {LORA_WEIGHTS_PATH}. Using base model.")
 
+    return _finish_model_load(model, tokenizer, device, precision, started_at, source=source)
+
+def _attach_adapters(base_model, adapters: Dict[str, str]):
+    """Loads each adapter unmerged onto one shared base model; only the adapter weights are added."""
+    model = None
+    for name, path in adapters.items():
+        started_at = time.perf_counter()
+        if model is None:
+            model = PeftModel.from_pretrained(base_model, path, adapter_name=name, is_trainable=False)
+        else:
+            model.load_adapter(path, adapter_name=name, is_trainable=False)
+        logger.info(f"💾 Loaded LoRA adapter '{name}' from {path} in {time.perf_counter() - started_at:.1f}s")
+    return model
+
+def _finish_model_load(model, tokenizer, device: str, precision: str, started_at: float, source: str):
+    """Device placement, eval mode and optional quantization shared by every load path."""
     if device == "cuda":
         model.to(device)
 
     model.config.pad_token_id = tokenizer.pad_token_id
     model.eval()
+    
+    if precision == "int8_dynamic":
+        # Quantize after the LoRA merge so the adapter deltas are folded into the int8 weights
+        model = _quantize_dynamic_int8(model)
+        logger.info("✅ Applied dynamic int8 quantization to Linear layers.")
+    
+    # The profile actually served, after fallbacks; seeded generation cache keys include it
+    model.inference_precision = precision
+    load_seconds = time.perf_counter() - started_at
+    MODEL_LOAD_SECONDS.labels(model.config.name_or_path, source).set(load_seconds)
+    logger.info(f"⏱️ Model ready in {load_seconds:.1f}s (precision={precision}, source={source})")
     return model, tokenizer
 
+def _load_draft_model_sync(config: Dict[str, Any], cache_dir: str, tokenizer):
+    """Loads the small draft model used for speculative decoding; it must share the main tokenizer."""
+    draft_model, draft_tokenizer = _load_model_sync(config, cache_dir, apply_lora=False)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"Draft model {config['model_name']} does not share the main model's tokenizer")
+    
+    draft_model.generation_config.num_assistant_tokens = settings.SPECULATIVE_NUM_DRAFT_TOKENS
+    draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+    return draft_model
+
+
+class _SpeculativeStats:
+    """Counts forward passes the calling thread makes through the main and the draft model."""
+
+    def __init__(self, model, draft_model):
+        self.thread_id = threading.get_ident()
+        self.verify_passes = 0
+        self.draft_passes = 0
+        self._handles = [
+            model.register_forward_hook(self._count_verify),
+            draft_model.register_forward_hook(self._count_draft),
+        ]
+
+    def _count_verify(self, module, args, output):
+        if threading.get_ident() == self.thread_id:
+            self.verify_passes += 1
+
+    def _count_draft(self, module, args, output):
+        if threading.get_ident() == self.thread_id:
+            self.draft_passes += 1
+
+    def accepted_tokens(self, new_tokens: int) -> int:
+        # Every verification pass yields the accepted draft tokens plus one token of its own
+        return max(0, new_tokens - self.verify_passes)
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+
+
+# --- Continuous batching for concurrent generation requests ---
+def _cache_layers(cache) -> List[tuple]:
+    """Returns the per-layer (key, value) tensors of a DynamicCache."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _build_cache(layers: List[tuple]) -> DynamicCache:
+    """Builds a fresh DynamicCache from per-layer (key, value) tensors."""
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+class PrefixKVCache:
+    """Prefilled past_key_values for a fixed prompt prefix shared by many requests."""
+
+    def __init__(self, text: str, input_ids: List[int], layers: List[tuple], adapter: Optional[str] = None):
+        self.text = text
+        self.input_ids = input_ids
+        self.layers = layers
+        # The KV values depend on the LoRA adapter that was active during the prefill
+        self.adapter = adapter
+
+    @classmethod
+    def build(cls, model, tokenizer, text: str, adapter: Optional[str] = None) -> "PrefixKVCache":
+        input_ids = tokenizer.encode(text)
+        inputs = torch.tensor([input_ids], device=model.device)
+        with torch.inference_mode():
+            outputs = model(input_ids=inputs, attention_mask=torch.ones_like(inputs), use_cache=True)
+        return cls(text, input_ids, _cache_layers(outputs.past_key_values), adapter)
+
+    def expand(self, batch_size: int = 1) -> DynamicCache:
+        """Returns a private copy of the prefix cache repeated batch_size times."""
+        return _build_cache([(k.repeat(batch_size, 1, 1, 1), v.repeat(batch_size, 1, 1, 1)) for k, v in self.layers])
+
+
+class PromptTemplate:
+    """
+    Pre-tokenized parts of a story prompt that only depend on (language, genre, tone, length):
+    the <bos> + few-shot prefix, the instruction turn up to the user's idea, and the closing
+    turn markers. At request time only the user's own text is tokenized.
+    """
+
+    def __init__(self, prefix_text: str, prefix_ids: List[int], instruction_ids: List[int], closing_ids: List[int]):
+        self.prefix_text = prefix_text
+        self.prefix_ids = prefix_ids
+        self.instruction_ids = instruction_ids
+        self.closing_ids = closing_ids
+
+    def encode(self, tokenizer, user_text: str, max_input_length: int = 1024) -> List[int]:
+        user_ids = tokenizer.encode(user_text, add_special_tokens=False)
+        return (self.prefix_ids + self.instruction_ids + user_ids + self.closing_ids)[:max_input_length]
+
+
+class LoRAAdapterSet:
+    """
+    Named, unmerged PEFT adapters on one shared base model. Only one adapter is active at
+    a time, so switching is guarded by a lock; callers that run generations outside the
+    batch scheduler hold it for the whole generation via using().
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.names = list(model.peft_config.keys())
+        self.active: Optional[str] = model.active_adapter
+        self.switches = 0
+        self.lock = threading.RLock()
+
+    def resolve(self, language: str, genre: str) -> Optional[str]:
+        """Most specific adapter for a request: <language>_<genre>, then <language>, then default."""
+        for name in (f"{language}_{genre.lower()}", language, "default"):
+            if name in self.model.peft_config:
+                return name
+        return None
+
+    def activate(self, name: Optional[str]):
+        """Makes an adapter active; None runs the plain base model."""
+        with self.lock:
+            if name == self.active:
+                return
+            if name is None:
+                self.model.base_model.disable_adapter_layers()
+            else:
+                if self.active is None:
+                    self.model.base_model.enable_adapter_layers()
+                self.model.set_adapter(name)
+            self.active = name
+            self.switches += 1
+
+    @contextmanager
+    def using(self, name: Optional[str]):
+        with self.lock:
+            self.activate(name)
+            yield
+
+
+# Sentence-final punctuation, including the Devanagari danda, optionally followed by closing quotes
+SENTENCE_END = re.compile(r"[.!?\u0964][\"'\u201d\u2019)]*\s*$")
+
+
+class IncrementalDecoder:
+    """
+    Detokenizes generated ids one token at a time, re-decoding only the short window since
+    the last emitted text. Special tokens are kept so callers can see turn markers.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.token_ids: List[int] = []
+        self._prefix_offset = 0
+        self._read_offset = 0
+
+    def push(self, token_id: int) -> str:
+        """Returns the text the new token completes, or "" while a character is still partial."""
+        self.token_ids.append(token_id)
+        prefix_text = self.tokenizer.decode(self.token_ids[self._prefix_offset:self._read_offset], skip_special_tokens=False)
+        new_text = self.tokenizer.decode(self.token_ids[self._prefix_offset:], skip_special_tokens=False)
+        # A trailing replacement char means a multi-byte (e.g. Devanagari) character is incomplete
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return ""
+        self._prefix_offset, self._read_offset = self._read_offset, len(self.token_ids)
+        return new_text[len(prefix_text):]
+
+
+def _end_token_ids(tokenizer) -> set:
+    """<eos> and <end_of_turn>: the model ending the story on its own."""
+    return {
+        token_id for token_id in (tokenizer.eos_token_id, tokenizer.convert_tokens_to_ids("<end_of_turn>"))
+        if token_id is not None and token_id != tokenizer.unk_token_id
+    }
+
+
+class StoryStopper:
+    """
+    Token-level stopping criteria for one story. Generation ends as soon as the model emits
+    <end_of_turn>/<eos>, starts a new turn or few-shot example, or reaches the first sentence
+    boundary after the requested word budget. Text is detokenized incrementally, so each
+    token costs one short decode.
+    """
+
+    def __init__(self, tokenizer, word_budget: Optional[int] = None):
+        self.tokenizer = tokenizer
+        self.word_budget = word_budget
+        start_of_turn = tokenizer.convert_tokens_to_ids("<start_of_turn>")
+        self.stop_token_ids = _end_token_ids(tokenizer) | (
+            {start_of_turn} if start_of_turn is not None and start_of_turn != tokenizer.unk_token_id else set()
+        )
+        self.decoder = IncrementalDecoder(tokenizer)
+        self.text = ""
+
+    def update(self, token_id: int) -> bool:
+        """Feeds the next generated token; returns True once generation should stop."""
+        if token_id in self.stop_token_ids:
+            return True
+        new_text = self.decoder.push(token_id)
+        if not new_text:
+            return False
+        self.text += new_text
+
+        # Markers span several tokens, so look at a tail long enough to contain the longest one
+        tail = self.text[-32:]
+        if any(marker in tail for marker in END_MARKERS):
+            return True
+        if self.word_budget and SENTENCE_END.search(self.text[-8:]):
+            return len(self.text.split()) >= self.word_budget
+        return False
+
+
+class _StopperCriteria(StoppingCriteria):
+    """Adapts a StoryStopper to model.generate, feeding it every token appended since the last call."""
+
+    def __init__(self, stopper: StoryStopper, prompt_length: int):
+        self.stopper = stopper
+        self.seen = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        stop = False
+        for token_id in input_ids[0, self.seen:].tolist():
+            stop = stop or self.stopper.update(token_id)
+        self.seen = input_ids.shape[1]
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+
+class _FirstTokenCriteria(StoppingCriteria):
+    """Never stops generation; marks when the first token exists, splitting prefill from decode timing."""
+
+    def __init__(self, timer: RequestTimer):
+        self.timer = timer
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        self.timer.mark_first_token()
+        return torch.zeros((input_ids.shape[0],), dtype=torch.bool, device=input_ids.device)
+
+
+class _CancelCriteria(StoppingCriteria):
+    """Ends model.generate at the next decode step once the request timed out or was cancelled."""
+
+    def __init__(self, cancel: CancelToken):
+        self.cancel = cancel
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full((input_ids.shape[0],), self.cancel.aborted, dtype=torch.bool, device=input_ids.device)
+
+
+class _GlobalRNGLock:
+    """
+    model.generate() samples from torch's process-global RNG and takes no per-call generator.
+    A seeded generation reseeds it and must not have other samplers draw from it until it
+    finishes, so it runs alone; unseeded generations only share it with each other. Waiting
+    seeded generations go first, so a steady stream of unseeded ones cannot starve them.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sharers = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive and not self._exclusive_waiting)
+            self._sharers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._sharers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._condition:
+            self._exclusive_waiting += 1
+            self._condition.wait_for(lambda: not self._exclusive and not self._sharers)
+            self._exclusive_waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+_global_rng_lock = _GlobalRNGLock()
+
+
+class GenerationRequest:
+    """A single tokenized prompt waiting for, or taking part in, a batched decode."""
+
+    def __init__(self, input_ids: List[int], max_new_tokens: int, loop: asyncio.AbstractEventLoop, stream: Optional[asyncio.Queue] = None, prefix: Optional[PrefixKVCache] = None, seed: Optional[int] = None, adapter: Optional[str] = None, stopper: Optional[StoryStopper] = None, cancel: Optional[CancelToken] = None, timer: Optional[RequestTimer] = None):
+        self.input_ids = input_ids
+        self.prefix = prefix
+        self.adapter = adapter
+        self.stopper = stopper
+        self.cancel = cancel
+        self.timer = timer
+        self.seed = seed
+        self.generator: Optional[torch.Generator] = None
+        self.max_new_tokens = max_new_tokens
+        self.generated_ids: List[int] = []
+        self.loop = loop
+        self.future = loop.create_future()
+        self.stream = stream
+        self.submitted_at = time.perf_counter()
+
+    @property
+    def aborted(self) -> bool:
+        return self.cancel is not None and self.cancel.aborted
+
+    def push(self, token_id: int):
+        """Forwards a freshly sampled token to a streaming consumer, if any."""
+        if self.stream is not None:
+            self.loop.call_soon_threadsafe(self.stream.put_nowait, token_id)
+
+    def resolve(self, result=None, error: Optional[BaseException] = None):
+        """Hands the result back to the awaiting coroutine on its own event loop."""
+        # A None on the stream tells streaming consumers that no more tokens follow
+        self.push(None)
+
+        def _set():
+            if self.future.done():
+                return
+            if error is not None:
+                self.future.set_exception(error)
+            else:
+                self.future.set_result(result)
+        self.loop.call_soon_threadsafe(_set)
+
+
+class ContinuousBatchScheduler:
+    """
+    Runs all generation requests against one shared model as a single left-padded batch.
+    New requests are prefilled and joined between decode steps, finished sequences
+    leave the batch immediately and each caller's future is resolved on its own.
+    With LoRA adapters, a batch only holds requests for one adapter; requests for other
+    adapters wait until it drains and are then started together as the next batch.
+    """
+
+    def __init__(self, model, tokenizer, generation_config: Dict[str, Any], max_batch_size: int, max_wait_ms: int, adapters: Optional[LoRAAdapterSet] = None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.adapters = adapters
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max(0, max_wait_ms) / 1000.0
+        self.pad_token_id = tokenizer.pad_token_id
+        self.eos_token_id = tokenizer.eos_token_id
+        self.logits_processor = LogitsProcessorList([
+            RepetitionPenaltyLogitsProcessor(generation_config["repetition_penalty"]),
+            TemperatureLogitsWarper(generation_config["temperature"]),
+            TopKLogitsWarper(generation_config["top_k"]),
+            TopPLogitsWarper(generation_config["top_p"]),
+        ])
+
+        self._pending: List[GenerationRequest] = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+        # Batch state, only touched by the scheduler thread
+        self._active: List[GenerationRequest] = []
+        self._adapter: Optional[str] = None
+        self._input_ids: Optional[torch.Tensor] = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._cache: Optional[DynamicCache] = None
+        self._next_logits: Optional[torch.Tensor] = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"🧵 Continuous batching scheduler started (max_batch_size={self.max_batch_size}, max_wait_ms={int(self.max_wait_seconds * 1000)})")
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        for request in self._pending + self._active:
+            request.resolve(error=RuntimeError("Generation scheduler stopped"))
+        self._pending.clear()
+        self._reset_batch()
+
+    async def submit(self, input_ids: List[int], max_new_tokens: int, stream: Optional[asyncio.Queue] = None, prefix: Optional[PrefixKVCache] = None, seed: Optional[int] = None, adapter: Optional[str] = None, word_budget: Optional[int] = None, cancel: Optional[CancelToken] = None, timer: Optional[RequestTimer] = None) -> List[int]:
+        """
+        Queues a prompt for batched generation and returns prompt + generated token ids.
+        When a stream queue is given, each sampled token id is also put on it as soon
+        as it exists, followed by None once the request has finished. When a prefix is
+        given, input_ids must start with prefix.input_ids and only the rest is prefilled.
+        A seed gives the request its own sampling generator, independent of its batch mates.
+        The adapter names the LoRA adapter the request runs with. Every request stops at
+        <end_of_turn> or a new turn marker, and after word_budget words at a sentence end.
+        A request whose cancel token aborts leaves the batch at the next decode step and
+        raises GenerationAborted. A timer gets the time of the request's first token.
+        """
+        stopper = StoryStopper(self.tokenizer, word_budget)
+        request = GenerationRequest(input_ids, max_new_tokens, asyncio.get_running_loop(), stream, prefix, seed, adapter, stopper, cancel, timer)
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Generation scheduler is not running")
+            self._pending.append(request)
+            self._condition.notify()
+        return await request.future
+
+    # --- Scheduler thread ---
+    def _run(self):
+        while True:
+            new_requests = self._collect_pending()
+            if new_requests is None:
+                return
+
+            try:
+                with torch.inference_mode():
+                    if new_requests:
+                        self._join(new_requests)
+                    self._decode_step()
+            except Exception as e:
+                logger.error(f"❌ Batched generation step failed: {e}", exc_info=True)
+                for request in self._active + (new_requests or []):
+                    request.resolve(error=e)
+                self._reset_batch()
+
+    def _collect_pending(self) -> Optional[List[GenerationRequest]]:
+        """Takes as many waiting requests as fit; blocks only while the batch is idle."""
+        with self._condition:
+            if not self._active:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                # Give concurrent callers a short window to join the same prefill
+                deadline = time.perf_counter() + self.max_wait_seconds
+                while self._running and len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            if not self._running:
+                return None
+
+            return self._take_pending(self.max_batch_size - len(self._active))
+
+    def _take_pending(self, free_slots: int) -> List[GenerationRequest]:
+        """
+        Picks the requests that may join the batch. An idle batch starts with the adapter of
+        the oldest waiting request and takes every waiting request for it; a running batch
+        only takes same-adapter requests queued ahead of the first request for another one.
+        """
+        # Requests that timed out or were cancelled while waiting never reach the model
+        for request in [request for request in self._pending if request.aborted]:
+            request.resolve(error=GenerationAborted(request.cancel.reason))
+            self._pending.remove(request)
+        if not self._pending:
+            return []
+        adapter = self._adapter if self._active else self._pending[0].adapter
+        taken, waiting = [], []
+        blocked = False
+        for request in self._pending:
+            if request.adapter != adapter:
+                blocked = blocked or bool(self._active)
+                waiting.append(request)
+            elif len(taken) < free_slots and not blocked:
+                taken.append(request)
+            else:
+                waiting.append(request)
+        self._pending = waiting
+        if taken and not self._active:
+            self._adapter = adapter
+        return taken
+
+    def _join(self, requests: List[GenerationRequest]):
+        """Prefills new requests, one group per shared prefix, and merges them into the running batch."""
+        if self.adapters is not None:
+            self.adapters.activate(self._adapter)
+        groups: Dict[int, List[GenerationRequest]] = {}
+        for request in requests:
+            groups.setdefault(id(request.prefix), []).append(request)
+
+        for group in groups.values():
+            input_ids, attention_mask, cache, logits = self._prefill(group, group[0].prefix)
+            self._merge(group, input_ids, attention_mask, cache, logits)
+
+    def _prefill(self, requests: List[GenerationRequest], prefix: Optional["PrefixKVCache"]):
+        """
+        Runs one left-padded prefill forward pass. When the requests share a precomputed
+        prefix, only their suffixes are encoded on top of a copy of the prefix KV cache;
+        the padding then sits between prefix and suffix and is masked out.
+        """
+        device = self.model.device
+        for request in requests:
+            if request.seed is not None:
+                request.generator = torch.Generator(device=device).manual_seed(request.seed)
+        prefix_len = len(prefix.input_ids) if prefix is not None else 0
+        suffixes = [request.input_ids[prefix_len:] for request in requests]
+        width = max(len(suffix) for suffix in suffixes)
+        input_ids = torch.full((len(requests), width), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(requests), width), dtype=torch.long)
+        for row, suffix in enumerate(suffixes):
+            input_ids[row, width - len(suffix):] = torch.tensor(suffix, dtype=torch.long)
+            attention_mask[row, width - len(suffix):] = 1
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+
+        if prefix is not None:
+            cache = prefix.expand(len(requests))
+            prefix_ids = torch.tensor([prefix.input_ids], dtype=torch.long, device=device).repeat(len(requests), 1)
+            input_ids = torch.cat([prefix_ids, input_ids], dim=-1)
+            attention_mask = torch.cat([torch.ones_like(prefix_ids), attention_mask], dim=-1)
+        else:
+            cache = DynamicCache()
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.model(
+            input_ids=input_ids[:, prefix_len:],
+            attention_mask=attention_mask,
+            position_ids=position_ids[:, prefix_len:],
+            past_key_values=cache,
+            use_cache=True,
+        )
+        return input_ids, attention_mask, outputs.past_key_values, outputs.logits[:, -1, :].float()
+
+    def _merge(self, requests: List[GenerationRequest], input_ids: torch.Tensor, attention_mask: torch.Tensor, cache: DynamicCache, logits: torch.Tensor):
+        """Appends freshly prefilled rows to the running batch."""
+        if not self._active:
+            self._active = list(requests)
+            self._input_ids, self._attention_mask = input_ids, attention_mask
+            self._cache, self._next_logits = cache, logits
+            return
+
+        # Left-pad whichever side is shorter so both batches share one sequence length
+        total = max(self._attention_mask.shape[1], attention_mask.shape[1])
+        merged_layers = [
+            (
+                torch.cat([self._left_pad(ok, total), self._left_pad(nk, total)], dim=0),
+                torch.cat([self._left_pad(ov, total), self._left_pad(nv, total)], dim=0),
+            )
+            for (ok, ov), (nk, nv) in zip(_cache_layers(self._cache), _cache_layers(cache))
+        ]
+        self._cache = _build_cache(merged_layers)
+        self._input_ids = torch.cat([
+            self._left_pad(self._input_ids, total, self.pad_token_id),
+            self._left_pad(input_ids, total, self.pad_token_id),
+        ], dim=0)
+        self._attention_mask = torch.cat([
+            self._left_pad(self._attention_mask, total),
+            self._left_pad(attention_mask, total),
+        ], dim=0)
+        self._next_logits = torch.cat([self._next_logits, logits], dim=0)
+        self._active.extend(requests)
+
+    def _decode_step(self):
+        """Samples one token per active row, retires finished rows and runs one forward pass."""
+        if not self._active:
+            return
+
+        scores = self.logits_processor(self._input_ids, self._next_logits)
+        probs = torch.softmax(scores, dim=-1)
+        next_tokens = torch.multinomial(probs, num_samples=1)
+        for row, request in enumerate(self._active):
+            if request.generator is not None:
+                next_tokens[row] = torch.multinomial(probs[row], num_samples=1, generator=request.generator)
+
+        finished, aborted = [], []
+        for row, request in enumerate(self._active):
+            token_id = int(next_tokens[row, 0])
+            request.generated_ids.append(token_id)
+            request.push(token_id)
+            if request.timer is not None and len(request.generated_ids) == 1:
+                request.timer.mark_first_token()
+            if (token_id == self.eos_token_id or len(request.generated_ids) >= request.max_new_tokens
+                    or (request.stopper is not None and request.stopper.update(token_id))):
+                finished.append(row)
+            elif request.aborted:
+                finished.append(row)
+                aborted.append(row)
+
+        self._input_ids = torch.cat([self._input_ids, next_tokens], dim=-1)
+        self._attention_mask = torch.cat([
+            self._attention_mask,
+            torch.ones_like(next_tokens, dtype=self._attention_mask.dtype),
+        ], dim=-1)
+
+        if finished:
+            for row in finished:
+                request = self._active[row]
+                if row in aborted:
+                    request.resolve(error=GenerationAborted(request.cancel.reason))
+                else:
+                    request.resolve(request.input_ids + request.generated_ids)
+            keep = [row for row in range(len(self._active)) if row not in finished]
+            if not keep:
+                self._reset_batch()
+                return
+            self._select_rows(keep)
+
+        position_ids = self._attention_mask.sum(dim=-1, keepdim=True) - 1
+        outputs = self.model(
+            input_ids=self._input_ids[:, -1:],
+            attention_mask=self._attention_mask,
+            position_ids=position_ids,
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values
+        self._next_logits = outputs.logits[:, -1, :].float()
+
+    def _select_rows(self, keep: List[int]):
+        """Drops finished rows and trims padding columns no remaining row needs."""
+        self._active = [self._active[row] for row in keep]
+        index = torch.tensor(keep, device=self._input_ids.device)
+        attention_mask = self._attention_mask.index_select(0, index)
+        start = int((attention_mask.sum(dim=0) > 0).nonzero()[0])
+
+        # The cache holds one column fewer than the ids: the newest token is not prefilled yet
+        self._cache = _build_cache([
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in _cache_layers(self._cache)
+        ])
+        self._input_ids = self._input_ids.index_select(0, index)[:, start:]
+        self._attention_mask = attention_mask[:, start:]
+        self._next_logits = self._next_logits.index_select(0, index)
+
+    def _reset_batch(self):
+        self._active = []
+        self._input_ids = self._attention_mask = self._cache = self._next_logits = None
+
+    @staticmethod
+    def _left_pad(tensor: torch.Tensor, length: int, value: int = 0) -> torch.Tensor:
+        """Left-pads the sequence dimension (dim 1 for ids/masks, dim 2 for KV tensors)."""
+        seq_dim = 2 if tensor.dim() == 4 else 1
+        missing = length - tensor.shape[seq_dim]
+        if missing <= 0:
+            return tensor
+        pad_shape = list(tensor.shape)
+        pad_shape[seq_dim] = missing
+        padding = torch.full(pad_shape, value, dtype=tensor.dtype, device=tensor.device)
+        return torch.cat([padding, tensor], dim=seq_dim)
+
+class _AsyncTokenStreamer(BaseStreamer):
+    """Forwards token ids produced by model.generate in a worker thread to an asyncio queue."""
+
+    def __init__(self, queue: asyncio.Queue, loop: asyncio.AbstractEventLoop):
+        self.queue = queue
+        self.loop = loop
+        self.prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are not part of the story
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, token_id)
+
+    def end(self):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+
+# Story ideas used to warm up the model before it is reported ready
+WARMUP_PROMPTS = [
+    ("A dragon and a knight become unlikely friends", "en", "fantasy"),
+    ("एक रहस्यमय घर जहां रोज नई घटनाएं होती हैं", "hi", "mystery"),
+    ("ఒక పిల్లి తన యజమాని యొక్క అన్ని రహస్యాలను చెబుతుంది", "te", "comedy"),
+]
+
+
 class NLPService:
     def __init__(self):
         self.is_initialized = False
+        # Background loading progress reported by /health/ready
+        self.load_state = "not_started"  # not_started, loading, warming_up, ready, failed
+        self.load_stage: Optional[str] = None
+        self.load_error: Optional[str] = None
+        self.load_started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup = {"completed": 0, "total": settings.MODEL_WARMUP_GENERATIONS, "seconds": None}
+        self._load_task: Optional[asyncio.Task] = None
         self.executor = ThreadPoolExecutor(max_workers=8) 
         self.models = {}
         self.tokenizers = {}
+        self.scheduler: Optional[ContinuousBatchScheduler] = None
+        self.prefix_caches: Dict[str, PrefixKVCache] = {}
+        self.model_version = ""
+        self.precision = ""
+        self.stopping = {"requests": 0, "stopped_early": 0, "saved_tokens": 0, "eos": 0, "max_new_tokens": 0}
+        self.prompt_templates: Dict[tuple, PromptTemplate] = {}
+        self.template_lookups = {"hits": 0, "misses": 0}
+        
+        # Sampling configuration is optimized for creative, controlled output
+        self.generation_config = {
+            "temperature": 0.9, 
+            "do_sample": True, 
+            "top_p": 0.9, 
+            "top_k": 40, 
+            "repetition_penalty": 1.1, 
+            "num_return_sequences": 1,
+        }
         
         self.model_configs = {
             "main": {
@@ -92,6 +953,15 @@ class NLPService:
                 "description": "Gemma 2 2B for multilingual stories"
             }
         }
+        if settings.SPECULATIVE_DRAFT_MODEL:
+            self.model_configs["draft"] = {
+                "model_name": settings.SPECULATIVE_DRAFT_MODEL,
+                "description": "Small draft model for speculative decoding, shares the Gemma tokenizer"
+            }
+        self.draft_model = None
+        self.adapters: Optional[LoRAAdapterSet] = None
+        self.backend: Optional[InferenceBackend] = None
+        self.replica_pool: Optional[ReplicaPool] = None
         # Load high-quality examples with clear template markers
         self.few_shot_examples = self._load_few_shot_examples()
 
@@ -126,24 +996,150 @@ class NLPService:
         key = "main"
         try:
             config = self.model_configs[key]
-            logger.info(f"📥 Loading main model: {config['model_name']}")
             
-            loop = asyncio.get_event_loop()
-            model, tokenizer = await loop.run_in_executor(
-                self.executor,
-                lambda: _load_model_sync(config, settings.MODEL_CACHE_DIR)
-            )
+            if settings.INFERENCE_REPLICAS > 1:
+                logger.info(f"📥 Loading main model: {config['model_name']}")
+                self.load_stage = "starting_replicas"
+                await self._start_replica_pool(config)
+                return
             
-            for lang in ["en", "hi", "te"]:
-                 self.tokenizers[lang] = tokenizer
-                 self.models[lang] = model
-                 
-            logger.info(f"✅ Main model loaded and successfully assigned to en, hi, te.")
+            # A pre-fork master may have loaded the model already (see preload)
+            loop = asyncio.get_event_loop()
+            if not self.models:
+                await loop.run_in_executor(self.executor, lambda: self._load_main_model_sync(config))
+
+            model, tokenizer = self.models["en"], self.tokenizers["en"]
+            # Prefilled here, not in _load_main_model_sync, so a pre-fork master never runs a forward pass
+            if settings.PREFIX_CACHE_ENABLED and self.backend.supports_prefix_cache and not self.prefix_caches:
+                self.load_stage = "precomputing_prefix_cache"
+                await loop.run_in_executor(self.executor, lambda: self._precompute_prefix_caches(model, tokenizer))
+            # Assisted generation verifies one sequence at a time, so it replaces batching
+            if settings.GENERATION_BATCHING_ENABLED and self.draft_model is None and self.backend.supports_batching:
+                self.scheduler = ContinuousBatchScheduler(
+                    model, tokenizer, self.generation_config,
+                    max_batch_size=settings.GENERATION_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.GENERATION_MAX_WAIT_MS,
+                    adapters=self.adapters,
+                )
+                self.scheduler.start()
             
         except Exception as e:
             logger.error(f"❌ Failed to load main model: {e}")
             raise 
 
+    def _load_main_model_sync(self, config: Dict[str, Any]):
+        """Loads the main model and everything derived from it in the calling thread; starts no threads and runs no forward pass."""
+        logger.info(f"📥 Loading main model: {config['model_name']}")
+        self.load_stage = "loading_model"
+        adapter_paths = self._adapter_paths()
+        model, tokenizer = _load_model_sync(config, settings.MODEL_CACHE_DIR, adapters=adapter_paths)
+        
+        for lang in ["en", "hi", "te"]:
+             self.tokenizers[lang] = tokenizer
+             self.models[lang] = model
+        
+        self.load_stage = "building_prompt_templates"
+        self._build_prompt_templates(tokenizer)
+        token_budgets.load(config['model_name'])
+        
+        if adapter_paths:
+            self.adapters = LoRAAdapterSet(model)
+            logger.info(f"🔀 LoRA adapters available: {', '.join(self.adapters.names)}")
+        self.model_version = self._model_version(config)
+        self.precision = model.inference_precision
+        
+        self.load_stage = "preparing_backend"
+        self.backend = self._create_backend(model)
+        
+        if "draft" in self.model_configs and self.backend.name == "eager":
+            draft_config = self.model_configs["draft"]
+            self.load_stage = "loading_draft_model"
+            try:
+                logger.info(f"📥 Loading draft model for speculative decoding: {draft_config['model_name']}")
+                self.draft_model = _load_draft_model_sync(draft_config, settings.MODEL_CACHE_DIR, tokenizer)
+            except Exception as e:
+                logger.error(f"❌ Failed to load draft model: {e}. Speculative decoding disabled.")
+             
+        logger.info(f"✅ Main model loaded and successfully assigned to en, hi, te.")
+
+    def preload(self):
+        """
+        Loads the main model synchronously in a pre-fork master process. Workers forked
+        afterwards share the weights copy-on-write; their lifespan prefills the prefix caches,
+        starts the scheduler and warms up. Not supported with INFERENCE_REPLICAS > 1.
+        """
+        if settings.INFERENCE_REPLICAS > 1:
+            raise RuntimeError("Pre-fork serving loads the model in-process; set INFERENCE_REPLICAS=1")
+        started_at = time.perf_counter()
+        self._load_main_model_sync(self.model_configs["main"])
+        self.load_stage = None
+        logger.info(f"✅ Preloaded main model in {time.perf_counter() - started_at:.1f}s")
+
+    async def _start_replica_pool(self, config: Dict[str, Any]):
+        """Starts model replicas in pinned worker processes; this process only keeps the tokenizer."""
+        loop = asyncio.get_event_loop()
+        tokenizer = await loop.run_in_executor(
+            self.executor,
+            lambda: _load_tokenizer_sync(config['model_name'], settings.MODEL_CACHE_DIR)
+        )
+        
+        self.replica_pool = ReplicaPool(settings.INFERENCE_REPLICAS, config, settings.INFERENCE_THREADS_PER_REPLICA)
+        await loop.run_in_executor(self.executor, self.replica_pool.start)
+        
+        for lang in ["en", "hi", "te"]:
+            self.tokenizers[lang] = tokenizer
+        await loop.run_in_executor(self.executor, lambda: self._build_prompt_templates(tokenizer))
+        token_budgets.load(config['model_name'])
+        self.model_version = self._model_version(config)
+        # Replicas resolve the same profile in their own processes
+        self.precision = _resolve_precision("cuda" if torch.cuda.is_available() else "cpu")
+        logger.info(f"✅ Main model served by {settings.INFERENCE_REPLICAS} replicas for en, hi, te.")
+
+    def _adapter_paths(self) -> Optional[Dict[str, str]]:
+        """Adapters to attach unmerged, or None to merge the single LoRA adapter into the base model."""
+        if not settings.LORA_ADAPTERS:
+            return None
+        paths = {}
+        if os.path.isdir(LORA_WEIGHTS_PATH):
+            paths["default"] = LORA_WEIGHTS_PATH
+        paths.update(settings.LORA_ADAPTERS)
+        return paths
+
+    def _model_version(self, config: Dict[str, Any]) -> str:
+        """Identifies the served weights, so cached generations are invalidated when any adapter changes."""
+        version = f"{config['model_name']}@{_adapter_fingerprint(LORA_WEIGHTS_PATH)}"
+        for name, path in sorted(settings.LORA_ADAPTERS.items()):
+            version += f"+{name}:{_adapter_fingerprint(path)}"
+        return version
+
+    def _create_backend(self, model) -> InferenceBackend:
+        """Wraps the loaded model in the configured inference backend."""
+        name = settings.INFERENCE_BACKEND.lower()
+        if name != "eager" and self.adapters is not None:
+            # Compiled graphs and ONNX exports bake in one set of weights; adapters switch per request
+            logger.warning(f"⚠️ INFERENCE_BACKEND={name} does not support per-request LoRA adapters. Using eager.")
+            name = "eager"
+        if name != "eager" and "draft" in self.model_configs:
+            logger.warning(f"⚠️ Speculative decoding needs the eager backend; it is disabled with INFERENCE_BACKEND={name}.")
+        backend = create_backend(name, model, settings.MODEL_CACHE_DIR, self.model_version)
+        logger.info(f"⚙️ Inference backend: {backend.name}")
+        return backend
+
+    def _select_adapter(self, language: str, genre: str) -> Optional[str]:
+        return self.adapters.resolve(language, genre) if self.adapters is not None else None
+
+    def _precompute_prefix_caches(self, model, tokenizer):
+        """Prefills <bos> + each few-shot demonstration once so requests only encode their own suffix."""
+        started_at = time.perf_counter()
+        # Prefix KV depends on the adapter; only the default one gets caches, to keep memory flat
+        adapter = "default" if self.adapters is not None and "default" in self.adapters.names else None
+        with self.adapters.using(adapter) if self.adapters is not None else nullcontext():
+            for key, demo in self.few_shot_examples.items():
+                self.prefix_caches[key] = PrefixKVCache.build(model, tokenizer, self._build_prompt_prefix(demo), adapter)
+        
+        total_tokens = sum(len(prefix.input_ids) for prefix in self.prefix_caches.values())
+        logger.info(f"✅ Precomputed KV cache for {len(self.prefix_caches)} few-shot prefixes ({total_tokens} tokens) in {time.perf_counter() - started_at:.2f}s")
+
     async def initialize(self):
         try:
             logger.info("🚀 Initializing NLP Service with Local Models...")
@@ -157,9 +1153,70 @@ class NLPService:
             self.is_initialized = False 
             raise 
 
+    def start_background_initialize(self):
+        """Loads and warms up the models in a background task so the API can serve other routes meanwhile."""
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._initialize_in_background())
+
+    async def _initialize_in_background(self):
+        self.load_state = "loading"
+        self.load_started_at = time.perf_counter()
+        try:
+            await self.initialize()
+        except Exception as e:
+            self.load_state = "failed"
+            self.load_error = str(e)
+            logger.info("❌ StoryGenie running without AI generation capabilities. Check Hugging Face key or memory.")
+            return
+        self.load_seconds = round(time.perf_counter() - self.load_started_at, 2)
+        
+        self.load_state = "warming_up"
+        self.load_stage = "warmup"
+        await self._warmup()
+        self.load_state = "ready"
+        self.load_stage = None
+        logger.info(f"✅ StoryGenie AI models ready {time.perf_counter() - self.load_started_at:.1f}s after startup")
+
+    async def _warmup(self):
+        """Runs a few short generations to fault in the weights and warm up the kernels."""
+        started_at = time.perf_counter()
+        for i in range(settings.MODEL_WARMUP_GENERATIONS):
+            prompt, language, genre = WARMUP_PROMPTS[i % len(WARMUP_PROMPTS)]
+            adapter = self._select_adapter(language, genre)
+            input_ids, prefix = self._encode_story_prompt(
+                self.tokenizers[language], prompt, language, genre, "light_hearted", "short", None, None, adapter
+            )
+            output = await self._generate_with_direct_model(
+                language, input_ids, "short", prefix, seed=i, max_new_tokens=settings.MODEL_WARMUP_MAX_NEW_TOKENS,
+                adapter=adapter, record_stats=False
+            )
+            if output is None:
+                logger.warning(f"⚠️ Warmup generation {i + 1} failed; continuing.")
+            self.warmup["completed"] = i + 1
+        
+        self.warmup["seconds"] = round(time.perf_counter() - started_at, 2)
+        if settings.MODEL_WARMUP_GENERATIONS:
+            logger.info(f"🔥 Warmup finished: {settings.MODEL_WARMUP_GENERATIONS} generations in {self.warmup['seconds']}s")
+
+    @property
+    def is_ready(self) -> bool:
+        return self.load_state == "ready"
+
+    def load_status(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.load_started_at if self.load_started_at else 0.0
+        return {
+            "state": self.load_state,
+            "stage": self.load_stage,
+            "error": self.load_error,
+            "elapsed_seconds": round(elapsed, 2),
+            "load_seconds": self.load_seconds,
+            "warmup": dict(self.warmup),
+            "model_version": self.model_version or None,
+        }
+
     async def generate_story(self, story_data: Dict[str, Any]) -> str:
         
-        if not self.is_initialized or "en" not in self.models:
+        if not self.is_initialized or "en" not in self.tokenizers:
             return "❌ AI service is not ready. Please check backend logs for model loading status."
             
         try:
@@ -168,40 +1225,192 @@ class NLPService:
             genre = story_data['genre']
             length = story_data['length']
             tone = story_data.get('tone', 'light_hearted')
+            seed = story_data.get('seed')
+            
+            # Seeded requests are deterministic, so identical ones can be served from cache
+            cache_key = None
+            if seed is not None:
+                cache_key = self._generation_cache_key(story_data)
+                cached_text = await generation_cache.get(cache_key)
+                if cached_text:
+                    logger.info(f"⚡ Served {language} story from generation cache")
+                    return cached_text
+            elif self._reuses_similar(story_data):
+                reused_text = await semantic_index.reuse(story_data)
+                if reused_text:
+                    return reused_text
             
             logger.info(f"🔄 Generating {language} story using local AI model...")
             
-            enhanced_prompt = self._build_gemma_prompt(
-                prompt, language, genre, 
-                tone, length, 
-                story_data.get('characters'), 
-                story_data.get('setting')
-            )
+            adapter = self._select_adapter(language, genre)
+            with timed("tokenize"):
+                input_ids, prefix = self._encode_story_prompt(
+                    self.tokenizers[language], prompt, language, genre, 
+                    tone, length, 
+                    story_data.get('characters'), 
+                    story_data.get('setting'),
+                    adapter
+                )
             
-            generated_text = await self._generate_with_direct_model(language, enhanced_prompt, length)
+            cancel = CancelToken(settings.MODEL_TIMEOUT_SECONDS)
+            generated_text = await self._generate_with_direct_model(language, input_ids, length, prefix, seed, adapter=adapter, cancel=cancel, timer=current_timer())
             
             if generated_text:
-                # Use Few-Shot and Gemma-specific cleaning logic
-                cleaned_text = self._clean_gemma_generated_text(generated_text)
+                with timed("clean"):
+                    cleaned_text = StoryCleaner.clean(generated_text)
                 
                 if len(cleaned_text.strip()) > 50:
                     logger.info(f"✅ AI-generated {language} story: {len(cleaned_text)} chars")
+                    if cache_key:
+                        generation_cache.set(cache_key, cleaned_text)
                     return cleaned_text
                 
             error_msg = "❌ AI story generation failed. Final text too short or empty. Try a different prompt."
             logger.error(f"❌ AI story generation failed for language={language}. Final text too short or empty.") 
             return error_msg
             
+        except GenerationAborted:
+            raise
         except Exception as e:
             logger.error(f"❌ Story generation CRITICAL ERROR: {str(e)}", exc_info=True) 
             return "❌ AI story generation failed due to an internal error. Please check logs."
+
+    async def stream_story(self, story_data: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams a story while it is being generated. Yields {"event": "token", "text": ...}
+        chunks of decoded text, then a single {"event": "done", ...} with the cleaned story
+        and timings, or {"event": "error", "message": ...} if generation failed. Errors from
+        a timed out generation carry "reason": "timed_out"; when the consumer stops iterating,
+        decoding stops at the next step.
+        """
+        if not self.is_initialized or "en" not in self.tokenizers:
+            yield {"event": "error", "message": "❌ AI service is not ready. Please check backend logs for model loading status."}
+            return
+            
+        try:
+            language = story_data['language']
+            length = story_data['length']
+            seed = story_data.get('seed')
+            tokenizer = self.tokenizers[language]
+            
+            cache_key = None
+            if seed is not None:
+                cache_key = self._generation_cache_key(story_data)
+                cached_text = await generation_cache.get(cache_key)
+                if cached_text:
+                    logger.info(f"⚡ Served streamed {language} story from generation cache")
+                    yield {"event": "token", "text": cached_text}
+                    yield {
+                        "event": "done",
+                        "content": cached_text,
+                        "generated_tokens": 0,
+                        "time_to_first_token_ms": 0.0,
+                        "total_time_ms": 0.0,
+                    }
+                    return
+            elif self._reuses_similar(story_data):
+                reused_text = await semantic_index.reuse(story_data)
+                if reused_text:
+                    yield {"event": "token", "text": reused_text}
+                    yield {
+                        "event": "done",
+                        "content": reused_text,
+                        "generated_tokens": 0,
+                        "time_to_first_token_ms": 0.0,
+                        "total_time_ms": 0.0,
+                    }
+                    return
+            
+            logger.info(f"🔄 Streaming {language} story using local AI model...")
+            
+            adapter = self._select_adapter(language, story_data['genre'])
+            input_ids, prefix = self._encode_story_prompt(
+                tokenizer, story_data['prompt'], language, story_data['genre'], 
+                story_data.get('tone', 'light_hearted'), length, 
+                story_data.get('characters'), 
+                story_data.get('setting'),
+                adapter
+            )
+            
+            started_at = time.perf_counter()
+            first_token_at = None
+            # Streamed chunks go through the same cleaner as non-streamed stories
+            decoder = IncrementalDecoder(tokenizer)
+            cleaner = StoryCleaner()
+            cancel = CancelToken(settings.MODEL_TIMEOUT_SECONDS)
+            
+            async for token_id in self._stream_with_direct_model(language, input_ids, length, prefix, seed, adapter, cancel):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunk = cleaner.feed(decoder.push(token_id))
+                if chunk:
+                    yield {"event": "token", "text": chunk}
+            
+            finished_at = time.perf_counter()
+            chunk = cleaner.finish()
+            if chunk:
+                yield {"event": "token", "text": chunk}
+            generated_ids = decoder.token_ids
+            cleaned_text = cleaner.text
+            
+            if len(cleaned_text.strip()) <= 50:
+                logger.error(f"❌ AI story streaming failed for language={language}. Final text too short or empty.")
+                yield {"event": "error", "message": "❌ AI story generation failed. Final text too short or empty. Try a different prompt."}
+                return
+            
+            ttft_ms = round((first_token_at - started_at) * 1000, 1)
+            total_ms = round((finished_at - started_at) * 1000, 1)
+            logger.info(f"✅ Streamed {language} story: {len(generated_ids)} tokens, ttft={ttft_ms}ms, total={total_ms}ms")
+            if cache_key:
+                generation_cache.set(cache_key, cleaned_text)
+            yield {
+                "event": "done",
+                "content": cleaned_text,
+                "generated_tokens": len(generated_ids),
+                "time_to_first_token_ms": ttft_ms,
+                "total_time_ms": total_ms,
+            }
+            
+        except GenerationAborted as e:
+            yield {"event": "error", "message": f"❌ AI story generation {e.reason.replace('_', ' ')}.", "reason": e.reason}
+        except Exception as e:
+            logger.error(f"❌ Story streaming CRITICAL ERROR: {str(e)}", exc_info=True)
+            yield {"event": "error", "message": "❌ AI story generation failed due to an internal error. Please check logs."}
+    
+    def _generation_cache_key(self, story_data: Dict[str, Any]) -> str:
+        """Seeded output depends on the weights, their precision and the inference backend."""
+        backend = self.backend.name if self.backend is not None else settings.INFERENCE_BACKEND.lower()
+        return generation_cache.make_key(story_data, self.model_version, self.precision, backend)
+    
+    def _reuses_similar(self, story_data: Dict[str, Any]) -> bool:
+        """Unseeded requests may be served from a near-duplicate of the user's own stories; seeded ones must stay reproducible."""
+        return (
+            semantic_index.enabled and bool(story_data.get("user_id"))
+            and (story_data.get("reuse_similar") or settings.SEMANTIC_CACHE_AUTO_REUSE)
+        )
     
     def _build_gemma_prompt(self, prompt: str, language: str, genre: str, tone: str, length: str, characters: Optional[List[str]], setting: Optional[str]) -> str:
         """
         Builds a structured prompt using the Google Gemma Instruct format,
         implementing Few-Shot demonstration with clear structural markers.
         """
-        
+        prefix, instruction, closing = self._prompt_template_parts(language, genre, tone, length)
+        return prefix + instruction + self._user_message(prompt, characters, setting) + closing
+    
+    def _user_message(self, prompt: str, characters: Optional[List[str]], setting: Optional[str]) -> str:
+        """The per-request part of the prompt: the user's idea, characters and setting."""
+        user_message = f"{prompt}'"
+        if characters:
+            user_message += f"\n- Main Characters: {', '.join(characters)}"
+        if setting:
+            user_message += f"\n- Setting: {setting}"
+        return user_message
+    
+    def _prompt_template_parts(self, language: str, genre: str, tone: str, length: str) -> tuple:
+        """
+        Returns (prefix, instruction, closing): the few-shot prefix, the instruction turn up to
+        the opening quote of the user's idea, and the markers that hand the turn to the model.
+        """
         # 1. Select the relevant example
         example_key = f"{language}_{genre.lower()}"
         few_shot_demo = self.few_shot_examples.get(example_key, None)
@@ -226,132 +1435,332 @@ class NLPService:
             f"Begin immediately with the story's first sentence."
         )
         
-        user_message_new = f"Write the story based on this central plot idea: '{prompt}'"
-        
-        if characters:
-            user_message_new += f"\n- Main Characters: {', '.join(characters)}"
-        if setting:
-            user_message_new += f"\n- Setting: {setting}"
-
         # 2. Construct the Final Prompt with XML-like Delineation
-        final_prompt = "<bos>"
+        prefix = self._build_prompt_prefix(few_shot_demo)
+        
+        # The actual NEW task; the user's idea goes between instruction and closing
+        instruction = (
+            "<start_of_turn>user\n"
+            f"**INSTRUCTIONS:** {system_instruction_new}\n"
+            "**STORY IDEA:** Write the story based on this central plot idea: '"
+        )
+        closing = "<end_of_turn>\n<start_of_turn>model\n"
+        
+        return prefix, instruction, closing
+    
+    def _build_prompt_templates(self, tokenizer):
+        """Pre-tokenizes the prompt template for every language/genre/tone/length combination."""
+        started_at = time.perf_counter()
+        prefix_ids: Dict[str, List[int]] = {}
+        closing_ids = tokenizer.encode("<end_of_turn>\n<start_of_turn>model\n", add_special_tokens=False)
+        for combination in itertools.product(Language, Genre, Tone, Length):
+            language, genre, tone, length = (member.value for member in combination)
+            prefix, instruction, _ = self._prompt_template_parts(language, genre, tone, length)
+            if prefix not in prefix_ids:
+                prefix_ids[prefix] = tokenizer.encode(prefix)
+            # The instruction starts with <start_of_turn>, so it tokenizes independently of the prefix
+            self.prompt_templates[(language, genre, tone, length)] = PromptTemplate(
+                prefix, prefix_ids[prefix], tokenizer.encode(instruction, add_special_tokens=False), closing_ids
+            )
+        logger.info(f"✅ Pre-tokenized {len(self.prompt_templates)} prompt templates in {time.perf_counter() - started_at:.2f}s")
+    
+    def _encode_story_prompt(self, tokenizer, prompt: str, language: str, genre: str, tone: str, length: str, characters: Optional[List[str]], setting: Optional[str], adapter: Optional[str] = None, max_input_length: int = 1024):
+        """
+        Tokenizes a story prompt from its pre-tokenized template, so only the user's text is
+        encoded. Returns (input_ids, prefix) like _encode_prompt, which is the fallback on a miss.
+        """
+        template = self.prompt_templates.get((language, genre, tone, length))
+        if template is None:
+            self.template_lookups["misses"] += 1
+            full_prompt = self._build_gemma_prompt(prompt, language, genre, tone, length, characters, setting)
+            return self._encode_prompt(tokenizer, full_prompt, max_input_length, adapter)
+        
+        self.template_lookups["hits"] += 1
+        input_ids = template.encode(tokenizer, self._user_message(prompt, characters, setting), max_input_length)
+        for prefix in self.prefix_caches.values():
+            if prefix.text == template.prefix_text and prefix.adapter == adapter and len(input_ids) > len(prefix.input_ids):
+                return input_ids, prefix
+        return input_ids, None
+    
+    def template_stats(self) -> Dict[str, Any]:
+        lookups = self.template_lookups["hits"] + self.template_lookups["misses"]
+        return {
+            "templates": len(self.prompt_templates),
+            **self.template_lookups,
+            "hit_rate": round(self.template_lookups["hits"] / lookups, 3) if lookups else 0.0,
+        }
+    
+    def _build_prompt_prefix(self, few_shot_demo: Optional[str]) -> str:
+        """The fixed part of every prompt: <bos> plus the tagged few-shot demonstration."""
+        prefix = "<bos>"
         
         if few_shot_demo:
              # Structure: Use tags to clearly separate the demonstration from the current task
-             final_prompt += (
+             prefix += (
                  "\n<EXAMPLE_START>\n"
                  f"{few_shot_demo}"
                  "\n<EXAMPLE_END>\n\n"
              )
+        return prefix
+    
+    def _match_prefix(self, input_ids: List[int], adapter: Optional[str] = None) -> Optional[PrefixKVCache]:
+        """Finds the cached prefix an already tokenized prompt starts with, if any."""
+        for prefix in self.prefix_caches.values():
+            if prefix.adapter == adapter and len(input_ids) > len(prefix.input_ids) and input_ids[:len(prefix.input_ids)] == prefix.input_ids:
+                return prefix
+        return None
+    
+    def _encode_prompt(self, tokenizer, prompt: str, max_input_length: int = 1024, adapter: Optional[str] = None):
+        """
+        Tokenizes a prompt, reusing the pre-tokenized few-shot prefix when the prompt starts
+        with one. Returns (input_ids, prefix) where prefix is None if no cached prefix applies,
+        including when its KV cache was built with a different adapter.
+        """
+        for prefix in self.prefix_caches.values():
+            if prompt.startswith(prefix.text):
+                # The suffix starts with <start_of_turn>, so splitting here matches a full encode
+                input_ids = prefix.input_ids + tokenizer.encode(prompt[len(prefix.text):], add_special_tokens=False)
+                input_ids = input_ids[:max_input_length]
+                if len(input_ids) > len(prefix.input_ids) and prefix.adapter == adapter:
+                    return input_ids, prefix
+                return input_ids, None
         
-        # Add the actual NEW task
-        final_prompt += (
-            "<start_of_turn>user\n"
-            f"**INSTRUCTIONS:** {system_instruction_new}\n"
-            f"**STORY IDEA:** {user_message_new}"
-            "<end_of_turn>\n<start_of_turn>model\n"
-        )
-        
-        return final_prompt
+        return tokenizer.encode(prompt, truncation=True, max_length=max_input_length), None
     
-    async def _generate_with_direct_model(self, language: str, prompt: str, length: str) -> str:
-        """Generate using direct model access (runs synchronously in thread)."""
+    async def _generate_with_direct_model(self, language: str, input_ids: List[int], length: str, prefix: Optional[PrefixKVCache] = None, seed: Optional[int] = None, max_new_tokens: Optional[int] = None, adapter: Optional[str] = None, cancel: Optional[CancelToken] = None, timer: Optional[RequestTimer] = None, record_stats: bool = True) -> str:
+        """
+        Generate using direct model access (runs synchronously in thread). Raises
+        GenerationAborted when the cancel token times out or is cancelled. With a timer,
+        records prefill and decode time and the prompt and generated token counts.
+        Warmup passes record_stats=False to stay out of the stopping stats and metrics.
+        """
         try:
-            model = self.models[language]
+            model = self.models.get(language)
             tokenizer = self.tokenizers[language]
             
-            max_input_length = 1024 
-            inputs = tokenizer.encode(prompt, return_tensors="pt", truncation=True, max_length=max_input_length)
-            
-            if torch.cuda.is_available():
-                inputs = inputs.to(model.device)
-            
-            # Generation configuration is optimized for creative, controlled output
-            generation_config = {
-                "max_new_tokens": self._get_token_length(length),
-                "temperature": 0.9, 
-                "do_sample": True, 
-                "top_p": 0.9, 
-                "top_k": 40, 
-                "repetition_penalty": 1.1, 
-                "pad_token_id": tokenizer.pad_token_id,
-                "eos_token_id": tokenizer.eos_token_id, 
-                "num_return_sequences": 1,
-            }
+            max_new_tokens = max_new_tokens or self._get_token_length(language, length)
+            word_budget = self._get_word_budget(length)
+            started_at = time.perf_counter()
             
-            loop = asyncio.get_event_loop()
-            
-            def generate_direct_sync():
-                with torch.no_grad():
-                    return model.generate(
-                        inputs, 
-                        **generation_config,
-                        attention_mask=(inputs != tokenizer.pad_token_id)
-                    )
-
-            outputs = await loop.run_in_executor(self.executor, generate_direct_sync)
+            if self.replica_pool is not None:
+                output_ids = await self.replica_pool.submit(input_ids, max_new_tokens, seed=seed, adapter=adapter, word_budget=word_budget, cancel=cancel)
+            elif self.scheduler is not None:
+                # Concurrent requests share one padded batch on the scheduler thread
+                output_ids = await self.scheduler.submit(input_ids, max_new_tokens, prefix=prefix, seed=seed, adapter=adapter, word_budget=word_budget, cancel=cancel, timer=timer)
+            else:
+                loop = asyncio.get_event_loop()
+                output_ids = await loop.run_in_executor(
+                    self.executor,
+                    lambda: self._generate_sync(model, tokenizer, input_ids, max_new_tokens, prefix, seed, adapter=adapter, word_budget=word_budget, cancel=cancel, timer=timer)
+                )
             
-            return tokenizer.decode(outputs[0], skip_special_tokens=False) 
+            if timer is not None:
+                # Replica processes do not report their first token, so that path is timed as one "generate" stage
+                timer.split_generation(started_at, time.perf_counter())
+                timer.count("prompt_tokens", len(input_ids))
+                timer.count("generated_tokens", len(output_ids) - len(input_ids))
+            if record_stats:
+                self._record_stop(tokenizer, max_new_tokens, output_ids[len(input_ids):])
+                self._observe_generation(language, length, time.perf_counter() - started_at, len(output_ids) - len(input_ids))
+            # Only the new tokens are decoded; the prompt and few-shot demo never reach the cleaner
+            return tokenizer.decode(output_ids[len(input_ids):], skip_special_tokens=False)
             
+        except asyncio.CancelledError:
+            # The caller is gone; the worker thread keeps decoding until it sees the token
+            if cancel is not None:
+                cancel.cancel()
+            raise
+        except GenerationAborted as e:
+            if record_stats:
+                GENERATIONS.labels(language, length, e.reason).inc()
+            logger.warning(f"⏹️ {language} generation stopped: {e.reason}")
+            raise
         except Exception as e:
+            if record_stats:
+                GENERATIONS.labels(language, length, "failed").inc()
             logger.error(f"❌ Direct model generation failed for {language}: {e}", exc_info=True)
             return None
     
-    def _get_token_length(self, length: str) -> int:
-        """Translates abstract length to maximum new tokens."""
-        return {
-            "short": 300,
-            "medium": 500,
-            "long": 700
-        }.get(length, 400)
+    async def _stream_with_direct_model(self, language: str, input_ids: List[int], length: str, prefix: Optional[PrefixKVCache] = None, seed: Optional[int] = None, adapter: Optional[str] = None, cancel: Optional[CancelToken] = None) -> AsyncIterator[int]:
+        """
+        Yields generated token ids one at a time while the model is still decoding. If the
+        consumer stops early, the cancel token stops decoding at the next step.
+        """
+        model = self.models.get(language)
+        tokenizer = self.tokenizers[language]
+        max_new_tokens = self._get_token_length(language, length)
+        word_budget = self._get_word_budget(length)
+        queue: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        
+        if self.replica_pool is not None:
+            generation = asyncio.ensure_future(self.replica_pool.submit(input_ids, max_new_tokens, stream=queue, seed=seed, adapter=adapter, word_budget=word_budget, cancel=cancel))
+        elif self.scheduler is not None:
+            generation = asyncio.ensure_future(self.scheduler.submit(input_ids, max_new_tokens, stream=queue, prefix=prefix, seed=seed, adapter=adapter, word_budget=word_budget, cancel=cancel))
+        else:
+            streamer = _AsyncTokenStreamer(queue, loop)
+            
+            def generate_stream_sync():
+                try:
+                    return self._generate_sync(model, tokenizer, input_ids, max_new_tokens, prefix, seed, streamer, adapter, word_budget, cancel)
+                finally:
+                    # Unblock the consumer even if generate raised before calling end()
+                    loop.call_soon_threadsafe(queue.put_nowait, None)
+            
+            generation = loop.run_in_executor(self.executor, generate_stream_sync)
+        
+        try:
+            while True:
+                token_id = await queue.get()
+                if token_id is None:
+                    break
+                yield token_id
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client disconnected mid-stream
+            GENERATIONS.labels(language, length, "cancelled").inc()
+            if cancel is not None:
+                cancel.cancel()
+            generation.add_done_callback(lambda done: done.cancelled() or done.exception())
+            raise
+        
+        # Surfaces any generation error to the caller
+        try:
+            output_ids = await generation
+        except GenerationAborted as e:
+            GENERATIONS.labels(language, length, e.reason).inc()
+            raise
+        except Exception:
+            GENERATIONS.labels(language, length, "failed").inc()
+            raise
+        self._record_stop(tokenizer, max_new_tokens, output_ids[len(input_ids):])
+        self._observe_generation(language, length, time.perf_counter() - started_at, len(output_ids) - len(input_ids))
     
-    def _clean_gemma_generated_text(self, generated_text: str) -> str:
+    def _generate_sync(self, model, tokenizer, input_ids: List[int], max_new_tokens: int, prefix: Optional[PrefixKVCache] = None, seed: Optional[int] = None, streamer: Optional[BaseStreamer] = None, adapter: Optional[str] = None, word_budget: Optional[int] = None, cancel: Optional[CancelToken] = None, timer: Optional[RequestTimer] = None) -> List[int]:
         """
-        Aggressively removes all input artifacts (Few-Shot examples, current prompt, 
-        and special tokens) from the generated text, ensuring only the new story remains.
+        Runs one unbatched generate call on the inference backend in the calling worker thread;
+        returns prompt + new ids. Raises GenerationAborted if the cancel token stopped it.
         """
-        story_text = generated_text.strip()
+        backend = self.backend or InferenceBackend(model)
+        inputs = torch.tensor([input_ids], device=backend.device)
+        generation_config = {
+            **self.generation_config,
+            "max_new_tokens": max_new_tokens,
+            "pad_token_id": tokenizer.pad_token_id,
+            "eos_token_id": tokenizer.eos_token_id, 
+            "attention_mask": (inputs != tokenizer.pad_token_id).long(),
+            "streamer": streamer,
+            "stopping_criteria": StoppingCriteriaList([
+                _StopperCriteria(StoryStopper(tokenizer, word_budget), len(input_ids))
+            ]),
+        }
+        if cancel is not None:
+            generation_config["stopping_criteria"].append(_CancelCriteria(cancel))
+        if timer is not None:
+            generation_config["stopping_criteria"].append(_FirstTokenCriteria(timer))
+        
+        # The active adapter is model-wide state, so adapter generations run one at a time
+        adapter_context = self.adapters.using(adapter) if self.adapters is not None else nullcontext()
+        # generate() has no per-call generator, so a seeded run owns the global RNG from seeding to its last sample
+        rng_context = _global_rng_lock.exclusive() if seed is not None else _global_rng_lock.shared()
+        
+        if prefix is not None and self.draft_model is None:
+            # generate() only prefills the tokens not already covered by the cache
+            generation_config["past_key_values"] = prefix.expand()
+        
+        with rng_context, adapter_context:
+            if seed is not None:
+                torch.manual_seed(seed)
+            if self.draft_model is not None:
+                output_ids = self._generate_speculative_sync(model, inputs, generation_config)
+            else:
+                output_ids = backend.generate(inputs, **generation_config)[0].tolist()
+        
+        # Only a generation the token actually cut short counts as aborted
+        if cancel is not None and cancel.reason is not None:
+            raise GenerationAborted(cancel.reason)
+        return output_ids
     
-    # 1. Strip everything *before* the start of the final model generation turn.
-    # The actual new story content starts immediately after the final "<start_of_turn>model\n" tag.
-        final_model_marker = "<start_of_turn>model\n"
-        if final_model_marker in story_text:
-        # Find the last occurrence, which marks the start of the new response.
-            start_index = story_text.rfind(final_model_marker) + len(final_model_marker)
-            story_text = story_text[start_index:].strip()
+    def _generate_speculative_sync(self, model, inputs: torch.Tensor, generation_config: Dict[str, Any]) -> List[int]:
+        """
+        Speculative (assisted) decoding: the draft model proposes a few tokens and the main
+        model verifies them in one forward pass. With do_sample=True, transformers uses
+        speculative sampling, so the output distribution matches plain sampling.
+        """
+        stats = _SpeculativeStats(model, self.draft_model)
+        started_at = time.perf_counter()
+        try:
+            with torch.no_grad():
+                outputs = model.generate(inputs, assistant_model=self.draft_model, **generation_config)
+        finally:
+            stats.remove()
+        
+        elapsed = time.perf_counter() - started_at
+        new_tokens = outputs.shape[1] - inputs.shape[1]
+        accepted = stats.accepted_tokens(new_tokens)
+        acceptance_rate = accepted / stats.draft_passes if stats.draft_passes else 0.0
+        logger.info(
+            f"🎯 Speculative decoding: {new_tokens} tokens in {elapsed:.1f}s ({new_tokens / elapsed:.1f} tok/s), "
+            f"acceptance rate {acceptance_rate:.0%} ({accepted}/{stats.draft_passes} drafted tokens, {stats.verify_passes} verify passes)"
+        )
+        return outputs[0].tolist()
     
-    # 2. Remove all Few-Shot Delineation Tags (Just in case they remain)
-    # This specifically targets the EXAMPLE_START marker and anything before it.
-        story_text = story_text.split("<EXAMPLE_START>")[0].strip()
-        story_text = story_text.split("<EXAMPLE_END>")[0].strip()
+    def _get_word_budget(self, length: str) -> int:
+        """Target word count promised in the prompt; generation stops at the next sentence end after it."""
+        return WORD_BUDGETS.get(length, WORD_BUDGETS["medium"])
     
-    # 3. Remove all Gemma special tokens and instruction markers (Final scrubbing)
-        special_tokens_to_remove = ["<bos>", "<eos>", "<start_of_turn>", "<end_of_turn>", "user", "model", "**INSTRUCTIONS:**", "**STORY IDEA:**", "<EXAMPLE_START>", "<EXAMPLE_END>"]
+    def _record_stop(self, tokenizer, max_new_tokens: int, generated_ids: List[int]):
+        """
+        Tracks why each generation ended. Only StoryStopper stops (a new turn, an end marker or
+        the word budget) count as stopped early with tokens saved; a generation that ended on
+        <eos>/<end_of_turn> would have stopped there without it. Cancellation raises instead,
+        so a story that ends short of max_new_tokens on another token was ended by the stopper.
+        """
+        self.stopping["requests"] += 1
+        if len(generated_ids) >= max_new_tokens:
+            self.stopping["max_new_tokens"] += 1
+        elif generated_ids and generated_ids[-1] in _end_token_ids(tokenizer):
+            self.stopping["eos"] += 1
+        else:
+            self.stopping["stopped_early"] += 1
+            self.stopping["saved_tokens"] += max_new_tokens - len(generated_ids)
     
-        for token in special_tokens_to_remove:
-        # Use str.replace aggressively
-            story_text = story_text.replace(token, "").strip()
-
-    # 4. Final cleanup for formatting
-        lines = []
-        for line in story_text.split('\n'):
-            clean_line = line.strip()
-        # Filter noise lines and empty lines
-            if clean_line and len(clean_line.split()) > 4: 
-                lines.append(clean_line)
+    def _observe_generation(self, language: str, length: str, seconds: float, generated_tokens: int):
+        """Exports one finished generation to the Prometheus histograms."""
+        GENERATIONS.labels(language, length, "completed").inc()
+        GENERATION_DURATION.labels(language, length).observe(seconds)
+        if seconds > 0:
+            GENERATION_TOKENS_PER_SECOND.labels(language, length).observe(generated_tokens / seconds)
+    
+    def stopping_stats(self) -> Dict[str, Any]:
+        requests = self.stopping["requests"]
+        return {
+            **self.stopping,
+            "avg_saved_tokens": round(self.stopping["saved_tokens"] / requests, 1) if requests else 0.0,
+        }
+    
+    def _get_token_length(self, language: str, length: str) -> int:
+        """Translates abstract length to maximum new tokens, calibrated per language by calibrate_token_budgets.py."""
+        return token_budgets.get(language, length)
     
-        cleaned_text = '\n\n'.join(lines)
-
-    # Ensure the story ends with punctuation
-        if cleaned_text and cleaned_text.strip() and not cleaned_text.strip()[-1] in '.!?"\'।':
-            cleaned_text += '.'
-        
-        return cleaned_text.strip()
-
-
     async def close(self):
         """Shuts down the executor and clears resources."""
         try:
+            if self._load_task is not None and not self._load_task.done():
+                self._load_task.cancel()
+                await asyncio.gather(self._load_task, return_exceptions=True)
+            
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+            
+            self.draft_model = None
+            self.backend = None
+            
+            if self.replica_pool is not None:
+                self.replica_pool.stop()
+                self.replica_pool = None
+            
             if hasattr(self, 'executor'):
                 self.executor.shutdown(wait=True)
             
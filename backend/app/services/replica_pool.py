@@ -0,0 +1,246 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from typing import Dict, Any, Optional, List
+
+from transformers.generation.streamers import BaseStreamer
+
+from app.core.config import settings
+from app.services.cancellation import CancelToken, GenerationAborted
+
+logger = logging.getLogger(__name__)
+
+
+def _available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_core_sets(num_replicas: int, threads_per_replica: Optional[int] = None) -> List[List[int]]:
+    """Splits the usable CPU cores into disjoint, equally sized sets, one per replica."""
+    cores = _available_cores()
+    threads = threads_per_replica or max(1, len(cores) // num_replicas)
+    if threads * num_replicas > len(cores):
+        logger.warning(
+            f"⚠️ {num_replicas} replicas x {threads} threads exceeds {len(cores)} available cores; "
+            f"core sets will overlap."
+        )
+    return [
+        [cores[(replica * threads + i) % len(cores)] for i in range(threads)]
+        for replica in range(num_replicas)
+    ]
+
+
+class _ReplicaStreamer(BaseStreamer):
+    """Sends each generated token id from a replica process back to the API process."""
+
+    def __init__(self, result_queue, request_id: int):
+        self.result_queue = result_queue
+        self.request_id = request_id
+        self.prompt_seen = False
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are not part of the story
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        for token_id in value.reshape(-1).tolist():
+            self.result_queue.put(("token", self.request_id, token_id))
+
+    def end(self):
+        pass
+
+
+class _ReplicaCancelToken(CancelToken):
+    """Cancel token inside a replica; the API process cancels by writing the request id to shared memory."""
+
+    def __init__(self, timeout_seconds: Optional[float], cancelled, replica_id: int, request_id: int):
+        super().__init__(timeout_seconds)
+        self.cancelled = cancelled
+        self.replica_id = replica_id
+        self.request_id = request_id
+
+    @property
+    def aborted(self) -> bool:
+        if self.reason is None and self.cancelled[self.replica_id] == self.request_id:
+            self.reason = "cancelled"
+        return super().aborted
+
+
+def _replica_main(replica_id: int, cores: List[int], model_config: Dict[str, Any], request_queue, result_queue, cancelled):
+    """Entry point of a replica process: pin to its cores, load a model replica and serve requests."""
+    import torch
+    from app.services.nlp_service import NLPService, LoRAAdapterSet, _load_model_sync, _load_draft_model_sync
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+    try:
+        service = NLPService()
+        adapter_paths = service._adapter_paths()
+        model, tokenizer = _load_model_sync(model_config, settings.MODEL_CACHE_DIR, adapters=adapter_paths)
+        if adapter_paths:
+            service.adapters = LoRAAdapterSet(model)
+        service.model_version = service._model_version(model_config)
+        service.backend = service._create_backend(model)
+        if settings.PREFIX_CACHE_ENABLED and service.backend.supports_prefix_cache:
+            service._precompute_prefix_caches(model, tokenizer)
+        if "draft" in service.model_configs and service.backend.name == "eager":
+            service.draft_model = _load_draft_model_sync(service.model_configs["draft"], settings.MODEL_CACHE_DIR, tokenizer)
+    except Exception as e:
+        result_queue.put(("failed", replica_id, str(e)))
+        return
+
+    result_queue.put(("ready", replica_id, None))
+    while True:
+        message = request_queue.get()
+        if message is None:
+            break
+
+        request_id, input_ids, max_new_tokens, seed, stream, adapter, word_budget, timeout_seconds = message
+        try:
+            prefix = service._match_prefix(input_ids, adapter)
+            streamer = _ReplicaStreamer(result_queue, request_id) if stream else None
+            cancel = _ReplicaCancelToken(timeout_seconds, cancelled, replica_id, request_id)
+            if cancel.aborted:
+                raise GenerationAborted(cancel.reason)
+            output_ids = service._generate_sync(model, tokenizer, input_ids, max_new_tokens, prefix, seed, streamer, adapter, word_budget, cancel)
+            result_queue.put(("done", request_id, output_ids))
+        except GenerationAborted as e:
+            result_queue.put(("aborted", request_id, e.reason))
+        except Exception as e:
+            result_queue.put(("error", request_id, str(e)))
+
+
+class ReplicaPool:
+    """
+    K worker processes, each holding its own model replica pinned to a disjoint CPU core set
+    with torch.set_num_threads sized to that set. Requests go to the least-loaded replica;
+    each replica decodes one request at a time with all of its cores.
+    """
+
+    def __init__(self, num_replicas: int, model_config: Dict[str, Any], threads_per_replica: Optional[int] = None):
+        self.num_replicas = num_replicas
+        self.model_config = model_config
+        self.core_sets = plan_core_sets(num_replicas, threads_per_replica)
+        self._context = multiprocessing.get_context("spawn")
+        self._result_queue = self._context.Queue()
+        self._request_queues = [self._context.Queue() for _ in range(num_replicas)]
+        # Id of the request each replica should abort; replicas poll it once per decode step
+        self._cancelled = self._context.Array("q", [-1] * num_replicas)
+        self._processes = []
+        self._in_flight = [0] * num_replicas
+        self._pending: Dict[int, tuple] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader: Optional[threading.Thread] = None
+
+    def start(self, timeout: Optional[float] = None):
+        """Starts the replica processes and blocks until every replica has loaded its model."""
+        for replica_id, cores in enumerate(self.core_sets):
+            process = self._context.Process(
+                target=_replica_main,
+                args=(replica_id, cores, self.model_config, self._request_queues[replica_id], self._result_queue, self._cancelled),
+                name=f"inference-replica-{replica_id}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+            logger.info(f"🧩 Started inference replica {replica_id} on cores {cores}")
+
+        for _ in range(self.num_replicas):
+            status, replica_id, error = self._result_queue.get(timeout=timeout)
+            if status == "failed":
+                self.stop()
+                raise RuntimeError(f"Inference replica {replica_id} failed to load: {error}")
+
+        self._reader = threading.Thread(target=self._read_results, name="replica-results", daemon=True)
+        self._reader.start()
+        logger.info(f"✅ {self.num_replicas} inference replicas ready")
+
+    async def submit(self, input_ids: List[int], max_new_tokens: int, stream: Optional[asyncio.Queue] = None, seed: Optional[int] = None, adapter: Optional[str] = None, word_budget: Optional[int] = None, cancel: Optional[CancelToken] = None) -> List[int]:
+        """Runs one generation on the least-loaded replica; mirrors ContinuousBatchScheduler.submit."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._ids)
+        with self._lock:
+            replica_id = min(range(self.num_replicas), key=lambda r: self._in_flight[r])
+            self._in_flight[replica_id] += 1
+            self._pending[request_id] = (loop, future, stream, replica_id)
+
+        timeout_seconds = None
+        if cancel is not None:
+            timeout_seconds = cancel.remaining()
+            cancel.on_cancel(lambda: self._cancel(replica_id, request_id))
+        self._request_queues[replica_id].put((request_id, input_ids, max_new_tokens, seed, stream is not None, adapter, word_budget, timeout_seconds))
+        return await future
+
+    def _cancel(self, replica_id: int, request_id: int):
+        # One slot per replica, so the latest cancellation wins; an overwritten one still has its deadline
+        with self._lock:
+            if request_id in self._pending:
+                self._cancelled[replica_id] = request_id
+
+    def _read_results(self):
+        while True:
+            message = self._result_queue.get()
+            if message is None:
+                return
+
+            kind, request_id, payload = message
+            with self._lock:
+                entry = self._pending.get(request_id)
+                if entry is None:
+                    continue
+                loop, future, stream, replica_id = entry
+                if kind != "token":
+                    del self._pending[request_id]
+                    self._in_flight[replica_id] -= 1
+
+            if kind == "token":
+                loop.call_soon_threadsafe(stream.put_nowait, payload)
+                continue
+
+            if stream is not None:
+                loop.call_soon_threadsafe(stream.put_nowait, None)
+            if kind == "done":
+                loop.call_soon_threadsafe(self._settle, future, payload, None)
+            elif kind == "aborted":
+                loop.call_soon_threadsafe(self._settle, future, None, GenerationAborted(payload))
+            else:
+                loop.call_soon_threadsafe(self._settle, future, None, RuntimeError(payload))
+
+    @staticmethod
+    def _settle(future: asyncio.Future, result, error: Optional[BaseException]):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def load(self) -> List[int]:
+        """Requests currently in flight per replica."""
+        with self._lock:
+            return list(self._in_flight)
+
+    def stop(self):
+        for request_queue in self._request_queues:
+            request_queue.put(None)
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._result_queue.put(None)
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for loop, future, stream, _ in pending.values():
+            if stream is not None:
+                loop.call_soon_threadsafe(stream.put_nowait, None)
+            loop.call_soon_threadsafe(self._settle, future, None, RuntimeError("Inference replicas stopped"))
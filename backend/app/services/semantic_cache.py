@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from bson import ObjectId
+from transformers import AutoModel, AutoTokenizer
+
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import Counter
+from app.models.story import StoryStatus
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "storygenie_semantic_cache_lookups", "Near-duplicate story lookups by outcome", ("outcome",)
+)
+
+PartitionKey = Tuple[str, str, str, str, str]
+
+# Story fields the index embeds and partitions by, plus the content it is checked against
+INDEXED_FIELDS = {
+    "user_id": 1, "prompt": 1, "language": 1, "genre": 1, "tone": 1, "length": 1,
+    "characters": 1, "setting": 1, "content": 1
+}
+
+
+def partition_key(story: Dict[str, Any]) -> PartitionKey:
+    """Stories are only reused for their owner, and for the same language, genre, tone and length."""
+    return (str(story["user_id"]), story["language"], story["genre"], story.get("tone") or "light_hearted", story["length"])
+
+
+def is_reusable(content: Optional[str]) -> bool:
+    """The bar a fresh generation has to clear; failed generations are stored as "❌ ..." messages."""
+    return bool(content) and not content.startswith("❌") and len(content.strip()) > 50
+
+
+def request_text(story: Dict[str, Any]) -> str:
+    """What is embedded: the user's idea plus characters and setting, whitespace-normalized."""
+    parts = [story.get("prompt") or ""]
+    if story.get("characters"):
+        parts.append("Characters: " + ", ".join(story["characters"]))
+    if story.get("setting"):
+        parts.append("Setting: " + story["setting"])
+    return " ".join(" ".join(parts).split())
+
+
+class PromptEmbedder:
+    """Small CPU sentence encoder: mean-pooled, L2-normalized transformer outputs."""
+
+    def __init__(self, model_name: str, cache_dir: str):
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=cache_dir)
+        self.model = AutoModel.from_pretrained(model_name, cache_dir=cache_dir).eval()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=128, return_tensors="pt")
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return torch.nn.functional.normalize(pooled, dim=-1).numpy().astype(np.float32)
+
+
+class _Partition:
+    """Embeddings of one (user, language, genre, tone, length) group; capacity doubles as stories are added."""
+
+    def __init__(self, dim: int):
+        self.vectors = np.empty((16, dim), dtype=np.float32)
+        self.story_ids: List[str] = []
+
+    def add(self, story_id: str, vector: np.ndarray):
+        count = len(self.story_ids)
+        if count == len(self.vectors):
+            vectors = np.empty((count * 2, self.vectors.shape[1]), dtype=np.float32)
+            vectors[:count] = self.vectors
+            self.vectors = vectors
+        self.vectors[count] = vector
+        # Appended after the vector is written, so readers never see an id without its vector
+        self.story_ids.append(story_id)
+
+    def search(self, vector: np.ndarray) -> Optional[Tuple[str, float]]:
+        count = len(self.story_ids)
+        if not count:
+            return None
+        scores = self.vectors[:count] @ vector
+        best = int(np.argmax(scores))
+        return self.story_ids[best], float(scores[best])
+
+
+class SemanticStoryIndex:
+    """
+    Embedding index over stored stories' prompts, partitioned by (user, language, genre, tone,
+    length), for serving a user's paraphrased requests from one of their existing stories. Partitions are searched exactly with
+    one matrix-vector product. The index is persisted to disk, caught up with the stories
+    collection at startup and extended as new stories are saved.
+    """
+
+    def __init__(self, enabled: bool, model_name: str, threshold: float, path: str):
+        self.enabled = enabled
+        self.model_name = model_name
+        self.threshold = threshold
+        self.path = path
+        self.embedder: Optional[PromptEmbedder] = None
+        self.partitions: Dict[PartitionKey, _Partition] = {}
+        self.indexed: set = set()
+        self.is_ready = False
+        # One thread: embedding is CPU work and must not stall the event loop or the generation executor
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="semantic-index")
+        self._lock = threading.Lock()
+        self._build_task: Optional[asyncio.Task] = None
+        self.lookups = 0
+        self.reused = 0
+        self.offered = 0
+
+    def start_background_build(self):
+        if self.enabled and self._build_task is None:
+            self._build_task = asyncio.create_task(self._build())
+
+    async def _build(self):
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._build_sync)
+        except Exception as e:
+            logger.error(f"❌ Semantic story index failed to build: {e}. Near-duplicate reuse disabled.", exc_info=True)
+
+    def _build_sync(self):
+        started_at = time.perf_counter()
+        self.embedder = PromptEmbedder(self.model_name, settings.MODEL_CACHE_DIR)
+        self._load()
+
+        missing = []
+        stories = db.get_collection("stories").find(
+            {"status": {"$in": [StoryStatus.DONE.value, None]}, "word_count": {"$gt": 0}},
+            INDEXED_FIELDS
+        )
+        for story in stories:
+            if str(story["_id"]) not in self.indexed:
+                missing.append(story)
+                if len(missing) == 256:
+                    self._add_sync(missing)
+                    missing = []
+        self._add_sync(missing)
+        self.save()
+        self.is_ready = True
+        logger.info(f"🧭 Semantic story index ready: {len(self.indexed)} stories in {len(self.partitions)} partitions ({time.perf_counter() - started_at:.1f}s)")
+
+    def _add_sync(self, stories: List[Dict[str, Any]]):
+        stories = [
+            story for story in stories
+            if str(story["_id"]) not in self.indexed and is_reusable(story.get("content"))
+        ]
+        if not stories or self.embedder is None:
+            return
+        vectors = self.embedder.encode([request_text(story) for story in stories])
+        with self._lock:
+            for story, vector in zip(stories, vectors):
+                story_id = str(story["_id"])
+                if story_id in self.indexed:
+                    continue
+                self.partitions.setdefault(partition_key(story), _Partition(len(vector))).add(story_id, vector)
+                self.indexed.add(story_id)
+
+    def add(self, stories: List[Dict[str, Any]]):
+        """Indexes newly saved stories (documents with _id and the request fields) in the background."""
+        # Stories saved while the index builds are queued behind the build on the same thread
+        if self.enabled and self._build_task is not None and stories:
+            self.executor.submit(self._add_sync, stories)
+
+    async def find_similar(self, story_data: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        """(story_id, similarity) of the closest stored story in the request's partition above the threshold."""
+        if not self.is_ready or not story_data.get("user_id") or partition_key(story_data) not in self.partitions:
+            return None
+        match = await asyncio.get_running_loop().run_in_executor(self.executor, self._search_sync, story_data)
+        if match is None or match[1] < self.threshold:
+            return None
+        return match
+
+    def _search_sync(self, story_data: Dict[str, Any]) -> Optional[Tuple[str, float]]:
+        vector = self.embedder.encode([request_text(story_data)])[0]
+        return self.partitions[partition_key(story_data)].search(vector)
+
+    async def reuse(self, story_data: Dict[str, Any]) -> Optional[str]:
+        """Content of a near-duplicate stored story to serve instead of generating, counted in the avoidance rate."""
+        self.lookups += 1
+        story = await self._load_match(story_data)
+        if story is None:
+            SEMANTIC_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.reused += 1
+        SEMANTIC_CACHE_LOOKUPS.labels("reused").inc()
+        logger.info(f"🧭 Reused story {story['id']} for a near-duplicate {story_data['language']} request (similarity {story['similarity']})")
+        return story["content"]
+
+    async def offer(self, story_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """A near-duplicate stored story the client may choose instead of generating."""
+        story = await self._load_match(story_data)
+        if story is not None:
+            self.offered += 1
+            SEMANTIC_CACHE_LOOKUPS.labels("offered").inc()
+        return story
+
+    async def _load_match(self, story_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        match = await self.find_similar(story_data)
+        if match is None:
+            return None
+        story_id, similarity = match
+        story = db.get_collection("stories").find_one(
+            {"_id": ObjectId(story_id), "user_id": ObjectId(story_data["user_id"])},
+            {"title": 1, "prompt": 1, "content": 1}
+        )
+        if not story or not is_reusable(story.get("content")):
+            # Deleted or overwritten since it was indexed
+            return None
+        return {
+            "id": story_id,
+            "title": story.get("title"),
+            "prompt": story.get("prompt"),
+            "content": story["content"],
+            "similarity": round(similarity, 4),
+        }
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            if str(data["model"]) != self.model_name:
+                logger.warning(f"⚠️ Semantic index at {self.path} was built with {data['model']}; rebuilding.")
+                return
+            if data["keys"].ndim != 2 or data["keys"].shape[1] != len(PartitionKey.__args__):
+                logger.warning(f"⚠️ Semantic index at {self.path} is not partitioned by user; rebuilding.")
+                return
+            with self._lock:
+                for key, story_id, vector in zip(data["keys"], data["story_ids"], data["vectors"]):
+                    self.partitions.setdefault(tuple(str(part) for part in key), _Partition(len(vector))).add(str(story_id), vector)
+                    self.indexed.add(str(story_id))
+
+    def save(self):
+        """Writes all partitions to one .npz, atomically, so restarts only embed new stories."""
+        if self.embedder is None:
+            return
+        with self._lock:
+            keys, story_ids, vectors = [], [], []
+            for key, partition in self.partitions.items():
+                count = len(partition.story_ids)
+                keys.extend([key] * count)
+                story_ids.extend(partition.story_ids)
+                vectors.append(partition.vectors[:count])
+        if not vectors:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        staging_path = f"{self.path}.tmp-{os.getpid()}.npz"
+        np.savez(staging_path, model=self.model_name, keys=np.array(keys, dtype=str),
+                 story_ids=np.array(story_ids, dtype=str), vectors=np.concatenate(vectors))
+        os.replace(staging_path, self.path)
+
+    def close(self):
+        if self._build_task is not None and not self._build_task.done():
+            self._build_task.cancel()
+        if self.is_ready:
+            self.save()
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ready": self.is_ready,
+            "indexed_stories": len(self.indexed),
+            "partitions": len(self.partitions),
+            "lookups": self.lookups,
+            "reused": self.reused,
+            "offered": self.offered,
+            "generation_avoidance_rate": round(self.reused / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+# Global instance
+semantic_index = SemanticStoryIndex(
+    enabled=settings.SEMANTIC_CACHE_ENABLED,
+    model_name=settings.SEMANTIC_CACHE_MODEL,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    path=os.path.join(settings.MODEL_CACHE_DIR, "semantic_index.npz")
+)
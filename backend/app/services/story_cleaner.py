@@ -0,0 +1,131 @@
+import re
+
+# Markers that end the story: the model closed its turn or started a new turn or example
+END_MARKERS = ("<end_of_turn>", "<start_of_turn>", "<EXAMPLE_START>", "<EXAMPLE_END>", "<eos>")
+# Artifacts that are dropped wherever they appear inside the story
+DROP_MARKERS = ("<bos>", "<pad>", "**INSTRUCTIONS:**", "**STORY IDEA:**")
+
+MARKER_PATTERN = re.compile("|".join(re.escape(marker) for marker in END_MARKERS + DROP_MARKERS))
+MARKER_PREFIXES = frozenset(
+    marker[:i] for marker in END_MARKERS + DROP_MARKERS for i in range(1, len(marker))
+)
+MAX_MARKER_LENGTH = max(len(marker) for marker in END_MARKERS + DROP_MARKERS)
+
+# Lines with fewer than this many words are treated as noise (stray labels, "The End", ...)
+MIN_LINE_WORDS = 5
+SENTENCE_FINAL = '.!?"\'।'
+
+
+class StoryCleaner:
+    """
+    Single-pass cleaner for generated story text. It is fed only the newly generated text,
+    decoded with special tokens, either all at once or chunk by chunk while streaming, and
+    returns the cleaned text that can be emitted so far:
+
+    - everything from the first end marker (<end_of_turn>, a new turn or example) is cut;
+    - prompt artifacts such as <bos> or **INSTRUCTIONS:** are removed;
+    - each line is stripped, lines of fewer than five words are dropped and kept lines are
+      separated by a blank line;
+    - finish() closes the story with a full stop if it lacks sentence-final punctuation.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.finished = False
+        self._pending = ""
+        self._line = ""
+        self._line_kept = False
+        self._held_whitespace = ""
+        self._kept_lines = 0
+
+    @classmethod
+    def clean(cls, generated_text: str) -> str:
+        """Cleans a complete generation in one pass."""
+        cleaner = cls()
+        cleaner.feed(generated_text)
+        cleaner.finish()
+        return cleaner.text
+
+    def feed(self, chunk: str) -> str:
+        """Adds newly decoded text and returns the cleaned text that became final."""
+        if self.finished:
+            return ""
+        text = self._pending + chunk
+        self._pending = ""
+
+        out = []
+        position = 0
+        for match in MARKER_PATTERN.finditer(text):
+            out.append(self._add_text(text[position:match.start()]))
+            position = match.end()
+            if match.group() in END_MARKERS:
+                out.append(self._end_line())
+                self.finished = True
+                return self._emit(out)
+
+        # Hold back a tail that may be the start of a marker split across chunks
+        rest = text[position:]
+        hold = self._marker_prefix_length(rest)
+        if hold:
+            rest, self._pending = rest[:-hold], rest[-hold:]
+        out.append(self._add_text(rest))
+        return self._emit(out)
+
+    def finish(self) -> str:
+        """Flushes the last line and returns the remaining cleaned text."""
+        out = []
+        if not self.finished:
+            pending, self._pending = self._pending, ""
+            out.append(self._add_text(pending))
+            out.append(self._end_line())
+            self.finished = True
+        if self.text and not self.text[-1] in SENTENCE_FINAL:
+            out.append(".")
+        return self._emit(out)
+
+    # --- Internals ---
+    def _emit(self, parts) -> str:
+        emitted = "".join(parts)
+        self.text += emitted
+        return emitted
+
+    def _add_text(self, text: str) -> str:
+        if not text:
+            return ""
+        lines = text.split("\n")
+        out = [self._extend_line(lines[0])]
+        for line in lines[1:]:
+            out.append(self._end_line())
+            out.append(self._extend_line(line))
+        return "".join(out)
+
+    def _extend_line(self, text: str) -> str:
+        if self._line_kept:
+            # Trailing whitespace is only written once more text follows on the same line
+            combined = self._held_whitespace + text
+            stripped = combined.rstrip()
+            self._held_whitespace = combined[len(stripped):]
+            return stripped
+
+        self._line += text
+        if len(self._line.split()) < MIN_LINE_WORDS:
+            return ""
+        self._line_kept = True
+        self._kept_lines += 1
+        line = self._line.strip()
+        self._held_whitespace = self._line[len(self._line.rstrip()):]
+        self._line = ""
+        return ("\n\n" if self._kept_lines > 1 else "") + line
+
+    def _end_line(self) -> str:
+        self._line = ""
+        self._line_kept = False
+        self._held_whitespace = ""
+        return ""
+
+    @staticmethod
+    def _marker_prefix_length(text: str) -> int:
+        for length in range(min(len(text), MAX_MARKER_LENGTH - 1), 0, -1):
+            if text[-length:] in MARKER_PREFIXES:
+                return length
+        return 0
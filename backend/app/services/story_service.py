@@ -1,41 +1,31 @@
 import logging
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from bson import ObjectId
 from datetime import datetime
+from pymongo import UpdateOne
 
 from app.core.database import db
-from app.models.story import Story, StoryCreate, StoryResponse
+from app.models.story import Story, StoryCreate, StoryResponse, StoryStatus
 from app.models.user import User
+from app.services.semantic_cache import INDEXED_FIELDS, semantic_index
 
 logger = logging.getLogger(__name__)
 
 class StoryService:
-    def __init__(self):
-        self.stories_collection = db.get_collection("stories")
-        self.users_collection = db.get_collection("users")
+    # Collections are resolved on use, so importing the service does not connect to the database
+    # (a pre-fork master imports it before forking, and MongoClient is not fork-safe)
+    @property
+    def stories_collection(self):
+        return db.get_collection("stories")
     
-    async def create_story(self, story_data: StoryCreate, user_id: str) -> Story:
+    @property
+    def users_collection(self):
+        return db.get_collection("users")
+    
+    async def create_story(self, story_data: StoryCreate, user_id: str, status: str = StoryStatus.RUNNING.value) -> Story:
         try:
-            # Generate title from prompt
-            title = self._generate_title(story_data.prompt)
-            
-            # Create story document
-            story_dict = {
-                "user_id": ObjectId(user_id),
-                "title": title,
-                "prompt": story_data.prompt,
-                "genre": story_data.genre.value,
-                "language": story_data.language.value,
-                "length": story_data.length.value,
-                "tone": story_data.tone.value if story_data.tone else None,
-                "characters": story_data.characters,
-                "setting": story_data.setting,
-                "content": "",  # Will be filled by NLP service
-                "word_count": 0,
-                "is_favorite": False,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }
+            # Create story document; content will be filled by NLP service
+            story_dict = self._story_document(story_data, user_id, status)
             
             # Insert story
             result = self.stories_collection.insert_one(story_dict)
@@ -116,6 +106,7 @@ class StoryService:
                     "$set": {
                         "content": content,
                         "word_count": word_count,
+                        "status": StoryStatus.DONE.value,
                         "updated_at": datetime.utcnow()
                     }
                 }
@@ -124,6 +115,8 @@ class StoryService:
             success = result.modified_count > 0
             if success:
                 logger.info(f"Story content updated successfully for story: {story_id}")
+                if semantic_index.enabled:
+                    semantic_index.add([self.stories_collection.find_one({"_id": ObjectId(story_id)}, INDEXED_FIELDS)])
             else:
                 logger.warning(f"No story found to update: {story_id}")
             
@@ -132,6 +125,73 @@ class StoryService:
             logger.error(f"Error updating story content: {str(e)}")
             return False
     
+    async def update_story_status(self, story_id: str, user_id: str, status: str, error: Optional[str] = None) -> bool:
+        try:
+            if not ObjectId.is_valid(story_id):
+                logger.error(f"Invalid story ID: {story_id}")
+                return False
+            
+            result = self.stories_collection.update_one(
+                {"_id": ObjectId(story_id), "user_id": ObjectId(user_id)},
+                {
+                    "$set": {
+                        "status": status,
+                        "error": error,
+                        "updated_at": datetime.utcnow()
+                    }
+                }
+            )
+            
+            return result.matched_count > 0
+        except Exception as e:
+            logger.error(f"Error updating story status: {str(e)}")
+            return False
+    
+    async def save_bulk_stories(self, user_id: str, stories: List[Tuple[str, StoryCreate, str]]) -> int:
+        """
+        Stores finished (bulk_key, request, content) stories for one user with a single unordered
+        bulk write. Stories are upserted by bulk_key, so writing a batch again after a crash adds
+        no duplicates. Returns the number of new stories.
+        """
+        if not stories:
+            return 0
+        self.stories_collection.create_index("bulk_key", unique=True, sparse=True)
+        documents, operations = [], []
+        for bulk_key, story_data, content in stories:
+            document = self._story_document(story_data, user_id, StoryStatus.DONE.value, content)
+            document["bulk_key"] = bulk_key
+            documents.append(document)
+            operations.append(UpdateOne({"bulk_key": bulk_key}, {"$setOnInsert": document}, upsert=True))
+        result = self.stories_collection.bulk_write(operations, ordered=False)
+        if semantic_index.enabled:
+            semantic_index.add([{**documents[index], "_id": story_id} for index, story_id in result.upserted_ids.items()])
+        if result.upserted_count:
+            self.users_collection.update_one(
+                {"_id": ObjectId(user_id)},
+                {"$inc": {"story_count": result.upserted_count}}
+            )
+        return result.upserted_count
+    
+    def _story_document(self, story_data: StoryCreate, user_id: str, status: str, content: str = "") -> dict:
+        now = datetime.utcnow()
+        return {
+            "user_id": ObjectId(user_id),
+            "title": self._generate_title(story_data.prompt),
+            "prompt": story_data.prompt,
+            "genre": story_data.genre.value,
+            "language": story_data.language.value,
+            "length": story_data.length.value,
+            "tone": story_data.tone.value if story_data.tone else None,
+            "characters": story_data.characters,
+            "setting": story_data.setting,
+            "content": content,
+            "word_count": len(content.split()),
+            "status": status,
+            "is_favorite": False,
+            "created_at": now,
+            "updated_at": now
+        }
+    
     def _generate_title(self, prompt: str) -> str:
         """Generate a title from the prompt"""
         words = prompt.split()[:6]
@@ -0,0 +1,146 @@
+import json
+import logging
+import math
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.story import Language, Length
+
+logger = logging.getLogger(__name__)
+
+# Story lengths promised in the prompt ("around 200 words", ...)
+WORD_BUDGETS = {Length.SHORT.value: 200, Length.MEDIUM.value: 400, Length.LONG.value: 600}
+
+# Uncalibrated max_new_tokens, the same for every language
+DEFAULT_TOKEN_BUDGETS = {Length.SHORT.value: 300, Length.MEDIUM.value: 500, Length.LONG.value: 700}
+
+# The stopper ends at the first sentence end after the word budget, so the budget allows some words beyond it
+SENTENCE_HEADROOM = 0.15
+
+# Budgets cover this quantile of the measured tokens-per-word ratios, not the mean
+RATIO_QUANTILE = 0.9
+
+TRAINING_LANGUAGES = {"English": Language.ENGLISH.value, "Hindi": Language.HINDI.value, "Telugu": Language.TELUGU.value}
+MODEL_TURN = "<start_of_turn>model\n"
+
+
+def tokens_per_word(tokenizer, text: str) -> Optional[float]:
+    words = len(text.split())
+    if not words:
+        return None
+    return len(tokenizer.encode(text, add_special_tokens=False)) / words
+
+
+def training_samples(path: str) -> List[Tuple[str, str]]:
+    """(language, story) pairs from the LoRA training data; the language is named in the instruction."""
+    with open(path, encoding="utf-8") as f:
+        records = json.load(f)
+    samples = []
+    for record in records:
+        text = record.get("text", "")
+        match = re.search(r"entirely in \*\*(\w+)\*\*", text)
+        if not match or match.group(1) not in TRAINING_LANGUAGES or MODEL_TURN not in text:
+            continue
+        story = text.split(MODEL_TURN)[-1].replace("<end_of_turn>", "").strip()
+        samples.append((TRAINING_LANGUAGES[match.group(1)], story))
+    return samples
+
+
+def _quantile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class TokenBudgets:
+    """
+    max_new_tokens per language and story length. Calibration measures how many tokens the
+    tokenizer needs per word of each language and sizes every length's budget to its word
+    count; languages without a calibration keep DEFAULT_TOKEN_BUDGETS.
+    """
+
+    def __init__(self, path: str, max_new_tokens: int):
+        self.path = path
+        self.max_new_tokens = max_new_tokens
+        self.tokenizer_name: Optional[str] = None
+        self.tokens_per_word: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+        self.budgets: Dict[str, Dict[str, int]] = {}
+
+    def get(self, language: str, length: str) -> int:
+        budgets = self.budgets.get(language) or DEFAULT_TOKEN_BUDGETS
+        return budgets.get(length, DEFAULT_TOKEN_BUDGETS[Length.MEDIUM.value])
+
+    def budget_for(self, ratio: float, length: str) -> int:
+        return min(self.max_new_tokens, math.ceil(WORD_BUDGETS[length] * ratio * (1 + SENTENCE_HEADROOM)))
+
+    def _derive_budgets(self):
+        self.budgets = {
+            language: {length: self.budget_for(ratio, length) for length in WORD_BUDGETS}
+            for language, ratio in self.tokens_per_word.items()
+        }
+
+    def calibrate(self, tokenizer, samples: Iterable[Tuple[str, str]], tokenizer_name: str):
+        """Replaces the table with budgets measured on (language, story) samples."""
+        ratios: Dict[str, List[float]] = {}
+        for language, text in samples:
+            ratio = tokens_per_word(tokenizer, text)
+            if ratio is not None:
+                ratios.setdefault(language, []).append(ratio)
+
+        self.tokenizer_name = tokenizer_name
+        self.tokens_per_word = {language: round(_quantile(values, RATIO_QUANTILE), 3) for language, values in ratios.items()}
+        self.samples = {language: len(values) for language, values in ratios.items()}
+        self._derive_budgets()
+
+    def load(self, tokenizer_name: str) -> bool:
+        """Loads the persisted table if it was calibrated with this tokenizer; otherwise defaults apply."""
+        self.tokens_per_word, self.samples, self.budgets = {}, {}, {}
+        if not os.path.isfile(self.path):
+            logger.info(f"📏 No token budget calibration at {self.path}; using default budgets.")
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not read token budgets from {self.path}: {e}. Using default budgets.")
+            return False
+        if data.get("tokenizer") != tokenizer_name:
+            logger.warning(f"⚠️ Token budgets in {self.path} were calibrated for {data.get('tokenizer')}, not {tokenizer_name}. Using default budgets.")
+            return False
+
+        self.tokenizer_name = tokenizer_name
+        self.tokens_per_word = data["tokens_per_word"]
+        self.samples = data.get("samples", {})
+        # Re-derived so changes to the word budgets or the cap apply without recalibrating
+        self._derive_budgets()
+        logger.info(f"📏 Loaded token budgets for {', '.join(sorted(self.budgets))} from {self.path}")
+        return True
+
+    def save(self):
+        """Writes the table atomically so workers never read a partial file."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        staging_path = f"{self.path}.tmp-{os.getpid()}"
+        with open(staging_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "tokenizer": self.tokenizer_name,
+                "tokens_per_word": self.tokens_per_word,
+                "samples": self.samples,
+                "budgets": self.budgets,
+            }, f, indent=2)
+        os.replace(staging_path, self.path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calibrated": sorted(self.budgets),
+            "tokens_per_word": self.tokens_per_word,
+            "budgets": {language.value: {length: self.get(language.value, length) for length in WORD_BUDGETS} for language in Language},
+        }
+
+
+# Global token budget table
+token_budgets = TokenBudgets(
+    settings.TOKEN_BUDGETS_PATH or os.path.join(settings.MODEL_CACHE_DIR, "token_budgets.json"),
+    settings.TOKEN_BUDGET_MAX_NEW_TOKENS
+)
@@ -0,0 +1,125 @@
+# benchmark_backends.py
+"""
+Compares the inference backends (INFERENCE_BACKEND) on the same prompt set with greedy
+decoding. Each backend runs in a fresh subprocess; its first call, which includes
+torch.compile or the ONNX session warmup, is reported separately from the timed runs.
+Outputs are checked token for token against the eager backend.
+
+    python benchmark_backends.py --backends eager compile onnx --max-new-tokens 64
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from benchmark_precision import PROMPTS
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def run_backend(backend_name: str, model_name: str, max_new_tokens: int, repeats: int) -> dict:
+    """Loads the model behind one backend and measures greedy decode throughput."""
+    import torch
+    from app.core.config import settings
+    from app.services.inference_backends import create_backend
+    from app.services.nlp_service import NLPService, _load_model_sync
+
+    model, tokenizer = _load_model_sync({"model_name": model_name}, settings.MODEL_CACHE_DIR)
+    started_at = time.perf_counter()
+    backend = create_backend(backend_name, model, settings.MODEL_CACHE_DIR, f"{model_name}@benchmark")
+    setup_seconds = time.perf_counter() - started_at
+
+    service = NLPService()
+    prompts = [
+        tokenizer.encode(
+            service._build_gemma_prompt(case["prompt"], case["language"], case["genre"], case["tone"], case["length"], None, None),
+            return_tensors="pt", truncation=True, max_length=1024,
+        ).to(backend.device)
+        for case in PROMPTS
+    ]
+
+    def generate(inputs):
+        return backend.generate(
+            inputs,
+            max_new_tokens=max_new_tokens,
+            min_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+            attention_mask=torch.ones_like(inputs),
+        )
+
+    started_at = time.perf_counter()
+    outputs = [generate(inputs)[0, inputs.shape[1]:].tolist() for inputs in prompts]
+    first_call_seconds = time.perf_counter() - started_at
+
+    generated_tokens = 0
+    decode_seconds = 0.0
+    for _ in range(repeats):
+        for inputs in prompts:
+            started_at = time.perf_counter()
+            generated = generate(inputs)
+            decode_seconds += time.perf_counter() - started_at
+            generated_tokens += generated.shape[1] - inputs.shape[1]
+
+    return {
+        "backend": backend_name,
+        # create_backend falls back to eager if the requested backend cannot be set up
+        "active_backend": backend.name,
+        "setup_seconds": round(setup_seconds, 2),
+        "first_call_seconds": round(first_call_seconds, 2),
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / decode_seconds, 2) if decode_seconds else 0.0,
+        "output_ids": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends")
+    parser.add_argument("--backends", nargs="+", default=["eager", "compile", "onnx"])
+    parser.add_argument("--model", default="google/gemma-2-2b-it")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--output", default="backend_report.json")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Child process: print exactly one JSON line for the parent to collect
+        print(json.dumps(run_backend(args.worker, args.model, args.max_new_tokens, args.repeats)))
+        return
+
+    backends = args.backends if "eager" in args.backends else ["eager"] + args.backends
+    results = []
+    for backend in backends:
+        logging.info(f"--- Benchmarking inference backend: {backend} ---")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", backend, "--model", args.model,
+             "--max-new-tokens", str(args.max_new_tokens), "--repeats", str(args.repeats)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            logging.error(f"❌ Backend {backend} failed:\n{completed.stderr[-2000:]}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    eager = next((r for r in results if r["backend"] == "eager"), None)
+    for r in results:
+        r["speedup"] = round(r["tokens_per_second"] / eager["tokens_per_second"], 2) if eager and eager["tokens_per_second"] else None
+        r["matches_eager"] = eager is not None and r["output_ids"] == eager["output_ids"]
+
+    print(f"\n{'backend':<10}{'active':<10}{'setup (s)':>11}{'first call (s)':>16}{'tokens/s':>10}{'speedup':>9}{'matches eager':>15}")
+    for r in results:
+        print(f"{r['backend']:<10}{r['active_backend']:<10}{r['setup_seconds']:>11}{r['first_call_seconds']:>16}{r['tokens_per_second']:>10}{str(r['speedup']):>9}{str(r['matches_eager']):>15}")
+
+    for r in results:
+        r.pop("output_ids")
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "max_new_tokens": args.max_new_tokens, "repeats": args.repeats, "prompts": len(PROMPTS), "results": results}, f, indent=2)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
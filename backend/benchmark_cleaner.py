@@ -0,0 +1,117 @@
+# benchmark_cleaner.py
+"""
+Compares the single-pass StoryCleaner with the previous post-processing, which decoded
+prompt + output and ran _clean_gemma_generated_text over the whole text, on long
+Hindi and Telugu generations.
+
+    python benchmark_cleaner.py --repeats 200
+"""
+import argparse
+import json
+import logging
+import time
+
+from app.core.config import settings
+from app.services.nlp_service import NLPService, IncrementalDecoder, _load_tokenizer_sync
+from app.services.story_cleaner import StoryCleaner
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Long model outputs (about 700 tokens) with a runaway next turn after <end_of_turn>
+STORIES = {
+    "hi": (
+        "पुराने शहर की तंग गलियों में एक बूढ़ा घड़ीसाज़ रहता था, जिसकी दुकान में समय कभी एक जैसा नहीं चलता था।\n"
+        "हर सुबह वह अपनी सबसे पुरानी घड़ी को चाबी देता और खिड़की से बाहर आती धूप को ध्यान से देखता।\n" * 14
+        + "<end_of_turn>\n<start_of_turn>user\n**INSTRUCTIONS:** Write another story.<end_of_turn>\n"
+    ),
+    "te": (
+        "ఒక చిన్న గ్రామంలో ఒక తెలివైన పిల్లి ఉండేది, అది ప్రతి రాత్రి ఊరంతా తిరిగి అందరి రహస్యాలు వినేది.\n"
+        "ఉదయం కాగానే అది పంచాయతీ అరుగు మీద కూర్చుని ఆ రహస్యాలన్నీ గట్టిగా చెప్పేది, కానీ ఎవరూ నమ్మేవారు కాదు.\n" * 14
+        + "<end_of_turn>\n<start_of_turn>user\n**INSTRUCTIONS:** Write another story.<end_of_turn>\n"
+    ),
+}
+
+
+def legacy_clean(generated_text: str) -> str:
+    """The previous NLPService._clean_gemma_generated_text, kept verbatim for comparison."""
+    story_text = generated_text.strip()
+    final_model_marker = "<start_of_turn>model\n"
+    if final_model_marker in story_text:
+        start_index = story_text.rfind(final_model_marker) + len(final_model_marker)
+        story_text = story_text[start_index:].strip()
+    story_text = story_text.split("<EXAMPLE_START>")[0].strip()
+    story_text = story_text.split("<EXAMPLE_END>")[0].strip()
+    special_tokens_to_remove = ["<bos>", "<eos>", "<start_of_turn>", "<end_of_turn>", "user", "model", "**INSTRUCTIONS:**", "**STORY IDEA:**", "<EXAMPLE_START>", "<EXAMPLE_END>"]
+    for token in special_tokens_to_remove:
+        story_text = story_text.replace(token, "").strip()
+    lines = []
+    for line in story_text.split('\n'):
+        clean_line = line.strip()
+        if clean_line and len(clean_line.split()) > 4:
+            lines.append(clean_line)
+    cleaned_text = '\n\n'.join(lines)
+    if cleaned_text and cleaned_text.strip() and not cleaned_text.strip()[-1] in '.!?"\'।':
+        cleaned_text += '.'
+    return cleaned_text.strip()
+
+
+def time_per_call(fn, repeats: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started_at) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the story output cleaner")
+    parser.add_argument("--model", default="google/gemma-2-2b-it")
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--output", default="cleaner_report.json")
+    args = parser.parse_args()
+
+    tokenizer = _load_tokenizer_sync(args.model, settings.MODEL_CACHE_DIR)
+    service = NLPService()
+
+    results = []
+    for language, story in STORIES.items():
+        genre = "mystery" if language == "hi" else "comedy"
+        prompt = service._build_gemma_prompt("A story idea", language, genre, "serious", "long", None, None)
+        prompt_ids = tokenizer.encode(prompt)
+        output_ids = tokenizer.encode(story, add_special_tokens=False)
+
+        def legacy():
+            return legacy_clean(tokenizer.decode(prompt_ids + output_ids, skip_special_tokens=False))
+
+        def single_pass():
+            return StoryCleaner.clean(tokenizer.decode(output_ids, skip_special_tokens=False))
+
+        def streamed():
+            decoder, cleaner = IncrementalDecoder(tokenizer), StoryCleaner()
+            for token_id in output_ids:
+                cleaner.feed(decoder.push(token_id))
+            cleaner.finish()
+            return cleaner.text
+
+        assert single_pass() == streamed(), "streamed and non-streamed cleaning disagree"
+        results.append({
+            "language": language,
+            "prompt_tokens": len(prompt_ids),
+            "output_tokens": len(output_ids),
+            "legacy_ms": round(time_per_call(legacy, args.repeats), 3),
+            "single_pass_ms": round(time_per_call(single_pass, args.repeats), 3),
+            # Streaming cost is spread over the decode; this is the total per story
+            "streamed_total_ms": round(time_per_call(streamed, max(1, args.repeats // 20)), 3),
+            "outputs_match": legacy() == single_pass(),
+        })
+
+    print(f"\n{'lang':<6}{'prompt tok':>11}{'output tok':>11}{'legacy ms':>11}{'single ms':>11}{'streamed ms':>13}{'match':>7}")
+    for r in results:
+        print(f"{r['language']:<6}{r['prompt_tokens']:>11}{r['output_tokens']:>11}{r['legacy_ms']:>11}{r['single_pass_ms']:>11}{r['streamed_total_ms']:>13}{str(r['outputs_match']):>7}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "repeats": args.repeats, "results": results}, f, indent=2, ensure_ascii=False)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# benchmark_nlp.py
+"""
+Micro-benchmark for NLPService that runs fully offline. It builds a tiny, randomly
+initialized Gemma-2 model with a BPE tokenizer trained on story_training_data.json,
+loads it through the normal NLPService start-up and drives generate_story/stream_story
+through the same batching, prefix-cache and stopping code paths as the API.
+
+Per configuration and concurrency level it reports time-to-first-token, tokens/sec,
+prefill vs decode forward time and p50/p95/p99 request latency, and writes JSON that
+can be compared across commits:
+
+    python benchmark_nlp.py --concurrency 1 4 16 --output nlp_benchmark.json
+    python benchmark_nlp.py --baseline nlp_benchmark.json --output nlp_benchmark_new.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_models", "tiny-gemma")
+# The production LoRA adapter does not fit the tiny model, so point the service at no adapter
+os.environ["LORA_WEIGHTS_PATH"] = os.path.join(MODEL_DIR, "no-adapter")
+
+from app.core.config import settings
+from app.services.nlp_service import NLPService
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("benchmark_nlp")
+logger.setLevel(logging.INFO)
+
+REQUESTS = [
+    {"prompt": "A dragon and a knight become unlikely friends", "language": "en", "genre": "fantasy", "tone": "light_hearted", "length": "short"},
+    {"prompt": "एक रहस्यमय घर जहां रोज नई घटनाएं होती हैं", "language": "hi", "genre": "mystery", "tone": "serious", "length": "short"},
+    {"prompt": "ఒక పిల్లి తన యజమాని యొక్క అన్ని రహస్యాలను చెబుతుంది", "language": "te", "genre": "comedy", "tone": "humorous", "length": "short"},
+    {"prompt": "A lighthouse keeper receives letters from the future", "language": "en", "genre": "sci-fi", "tone": "dramatic", "length": "short"},
+]
+
+# Settings overridden per configuration; "default" runs with the repository defaults
+CONFIGS = {
+    "default": {},
+    "no_prefix_cache": {"PREFIX_CACHE_ENABLED": False},
+    "no_batching": {"GENERATION_BATCHING_ENABLED": False},
+}
+
+
+def build_tiny_model(model_dir: str, hidden_size: int, num_layers: int):
+    """Trains a small byte-level BPE tokenizer and saves a randomly initialized Gemma-2 model."""
+    import torch
+    from tokenizers import Tokenizer, models, trainers, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, Gemma2Config, Gemma2ForCausalLM
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, "story_training_data.json"), encoding="utf-8") as f:
+        texts = [record["text"] for record in json.load(f)]
+    texts += list(NLPService().few_shot_examples.values())
+
+    special_tokens = ["<pad>", "<eos>", "<bos>", "<unk>", "<start_of_turn>", "<end_of_turn>"]
+    bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(texts, trainers.BpeTrainer(
+        vocab_size=4000, special_tokens=special_tokens, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    ))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, bos_token="<bos>", eos_token="<eos>", pad_token="<pad>", unk_token="<unk>",
+        additional_special_tokens=["<start_of_turn>", "<end_of_turn>"]
+    )
+    tokenizer.save_pretrained(model_dir)
+
+    config = Gemma2Config(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+        num_hidden_layers=num_layers, num_attention_heads=4, num_key_value_heads=2, head_dim=hidden_size // 4,
+        max_position_embeddings=4096, pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    torch.manual_seed(0)
+    Gemma2ForCausalLM(config).save_pretrained(model_dir)
+    logger.info(f"✅ Built tiny Gemma-2 model ({num_layers} layers, hidden {hidden_size}) in {model_dir}")
+
+
+class ForwardTimer:
+    """
+    Splits model forward time into prefill (more than one new token) and decode passes.
+    Without batching, concurrent requests run in parallel threads and their times add up.
+    """
+
+    def __init__(self, model):
+        self.prefill_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.prefill_passes = 0
+        self.decode_passes = 0
+        self._local = threading.local()
+        self._handles = [
+            model.register_forward_pre_hook(self._before, with_kwargs=True),
+            model.register_forward_hook(self._after, with_kwargs=True),
+        ]
+
+    def _before(self, module, args, kwargs):
+        input_ids = kwargs.get("input_ids", args[0] if args else None)
+        self._local.prefill = input_ids is not None and input_ids.shape[1] > 1
+        self._local.started_at = time.perf_counter()
+
+    def _after(self, module, args, kwargs, output):
+        elapsed = time.perf_counter() - self._local.started_at
+        if self._local.prefill:
+            self.prefill_seconds += elapsed
+            self.prefill_passes += 1
+        else:
+            self.decode_seconds += elapsed
+            self.decode_passes += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "prefill_ms": round(self.prefill_seconds * 1000, 1),
+            "decode_ms": round(self.decode_seconds * 1000, 1),
+            "prefill_passes": self.prefill_passes,
+            "decode_passes": self.decode_passes,
+        }
+
+    def reset(self):
+        self.prefill_seconds = self.decode_seconds = 0.0
+        self.prefill_passes = self.decode_passes = 0
+
+    def remove(self):
+        for handle in self._handles:
+            handle.remove()
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(seconds) -> dict:
+    return {f"p{int(q * 100)}_ms": round(percentile(seconds, q) * 1000, 1) for q in (0.5, 0.95, 0.99)}
+
+
+async def run_level(service: NLPService, timer: ForwardTimer, concurrency: int, num_requests: int) -> dict:
+    """Runs num_requests through generate_story and then stream_story with `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(i):
+        async with semaphore:
+            started_at = time.perf_counter()
+            await service.generate_story(dict(REQUESTS[i % len(REQUESTS)]))
+            return time.perf_counter() - started_at
+
+    async def stream(i):
+        async with semaphore:
+            started_at = time.perf_counter()
+            done = {}
+            async for event in service.stream_story(dict(REQUESTS[i % len(REQUESTS)])):
+                if event["event"] in ("done", "error"):
+                    done = event
+            finished_at = time.perf_counter()
+            # The first streamed chunk waits for the cleaner to see a full line, so time the first raw token instead
+            ttft = done["time_to_first_token_ms"] / 1000 if "time_to_first_token_ms" in done else finished_at - started_at
+            return ttft, finished_at - started_at, done.get("generated_tokens", 0)
+
+    timer.reset()
+    started_at = time.perf_counter()
+    latencies = await asyncio.gather(*[generate(i) for i in range(num_requests)])
+    generate_wall = time.perf_counter() - started_at
+    forward = timer.snapshot()
+
+    started_at = time.perf_counter()
+    streamed = await asyncio.gather(*[stream(i) for i in range(num_requests)])
+    stream_wall = time.perf_counter() - started_at
+    generated_tokens = sum(tokens for _, _, tokens in streamed)
+
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "latency": latency_summary(latencies),
+        "requests_per_second": round(num_requests / generate_wall, 2),
+        "time_to_first_token": latency_summary([ttft for ttft, _, _ in streamed]),
+        "stream_latency": latency_summary([total for _, total, _ in streamed]),
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / stream_wall, 1) if stream_wall else 0.0,
+        "forward": forward,
+    }
+
+
+async def run_config(name: str, overrides: dict, model_dir: str, levels, requests_per_level: int) -> dict:
+    defaults = {key: getattr(settings, key) for key in overrides}
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    service = NLPService()
+    service.model_configs["main"]["model_name"] = model_dir
+    try:
+        await service.initialize()
+        timer = ForwardTimer(service.models["en"])
+        # One untimed pass so lazy allocations do not land in the first level
+        await run_level(service, timer, 1, 2)
+        results = []
+        for concurrency in levels:
+            num_requests = max(requests_per_level, concurrency * 2)
+            result = await run_level(service, timer, concurrency, num_requests)
+            logger.info(f"[{name}] concurrency={concurrency}: p50={result['latency']['p50_ms']}ms, "
+                        f"ttft p50={result['time_to_first_token']['p50_ms']}ms, {result['tokens_per_second']} tok/s")
+            results.append(result)
+        timer.remove()
+        return {"config": name, "settings": overrides, "levels": results}
+    finally:
+        await service.close()
+        for key, value in defaults.items():
+            setattr(settings, key, value)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict = None):
+    previous = {}
+    if baseline:
+        for config in baseline["results"]:
+            for level in config["levels"]:
+                previous[(config["config"], level["concurrency"])] = level
+
+    print(f"\n{'config':<17}{'conc':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ttft p50':>10}{'tok/s':>9}{'prefill ms':>12}{'decode ms':>11}{'Δ p50':>9}")
+    for config in report["results"]:
+        for level in config["levels"]:
+            before = previous.get((config["config"], level["concurrency"]))
+            delta = ""
+            if before and before["latency"]["p50_ms"]:
+                delta = f"{(level['latency']['p50_ms'] / before['latency']['p50_ms'] - 1) * 100:+.1f}%"
+            print(f"{config['config']:<17}{level['concurrency']:>5}{level['latency']['p50_ms']:>9}{level['latency']['p95_ms']:>9}"
+                  f"{level['latency']['p99_ms']:>9}{level['time_to_first_token']['p50_ms']:>10}{level['tokens_per_second']:>9}"
+                  f"{level['forward']['prefill_ms']:>12}{level['forward']['decode_ms']:>11}{delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline NLPService micro-benchmark with a tiny Gemma-2 model")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=16, help="Requests per concurrency level (at least 2x concurrency)")
+    parser.add_argument("--configs", nargs="+", default=["default", "no_prefix_cache"], choices=sorted(CONFIGS))
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--hidden-size", type=int, default=128)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the tiny model even if it exists")
+    parser.add_argument("--baseline", help="Previous JSON report to compare p50 latency against")
+    parser.add_argument("--output", default="nlp_benchmark.json")
+    args = parser.parse_args()
+
+    if args.rebuild or not os.path.isfile(os.path.join(args.model_dir, "config.json")):
+        build_tiny_model(args.model_dir, args.hidden_size, args.layers)
+
+    results = []
+    for name in args.configs:
+        results.append(asyncio.run(run_config(name, CONFIGS[name], args.model_dir, args.concurrency, args.requests)))
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "model_dir": args.model_dir,
+        "requests": REQUESTS,
+        "results": results,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
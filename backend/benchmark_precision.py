@@ -0,0 +1,119 @@
+# benchmark_precision.py
+"""
+Compares the inference precision profiles (INFERENCE_PRECISION) on the same prompt set.
+Each profile is loaded in a fresh subprocess so load time and resident memory are not
+skewed by a previously loaded model.
+
+    python benchmark_precision.py --profiles float32 bfloat16 int8_dynamic --max-new-tokens 64
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PROMPTS = [
+    {"prompt": "A dragon and a knight become unlikely friends", "language": "en", "genre": "fantasy", "tone": "light_hearted", "length": "short"},
+    {"prompt": "एक रहस्यमय घर जहां रोज नई घटनाएं होती हैं", "language": "hi", "genre": "mystery", "tone": "dramatic", "length": "short"},
+    {"prompt": "ఒక యువకుడు ప్రాచీన నగరంలో గుప్త నిధిని కనుగొంటాడు", "language": "te", "genre": "adventure", "tone": "serious", "length": "short"},
+]
+
+
+def resident_memory_mb() -> float:
+    """Current resident set size of this process in MB (Linux), peak RSS elsewhere."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_profile(profile: str, model_name: str, max_new_tokens: int) -> dict:
+    """Loads the model with one precision profile and measures greedy decode throughput."""
+    import torch
+    from app.core.config import settings
+    from app.services.nlp_service import NLPService, _load_model_sync
+
+    rss_before = resident_memory_mb()
+    started_at = time.perf_counter()
+    model, tokenizer = _load_model_sync({"model_name": model_name}, settings.MODEL_CACHE_DIR, precision=profile)
+    load_seconds = time.perf_counter() - started_at
+    rss_after_load = resident_memory_mb()
+
+    service = NLPService()
+    generated_tokens = 0
+    decode_seconds = 0.0
+    for case in PROMPTS:
+        prompt = service._build_gemma_prompt(
+            case["prompt"], case["language"], case["genre"], case["tone"], case["length"], None, None
+        )
+        inputs = tokenizer.encode(prompt, return_tensors="pt", truncation=True, max_length=1024).to(model.device)
+        started_at = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(
+                inputs,
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+                attention_mask=torch.ones_like(inputs),
+            )
+        decode_seconds += time.perf_counter() - started_at
+        generated_tokens += outputs.shape[1] - inputs.shape[1]
+
+    return {
+        "profile": profile,
+        "load_seconds": round(load_seconds, 2),
+        "model_rss_mb": round(rss_after_load - rss_before, 1),
+        "peak_rss_mb": round(resident_memory_mb(), 1),
+        "generated_tokens": generated_tokens,
+        "tokens_per_second": round(generated_tokens / decode_seconds, 2) if decode_seconds else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference precision profiles")
+    parser.add_argument("--profiles", nargs="+", default=["float32", "bfloat16", "int8_dynamic"])
+    parser.add_argument("--model", default="google/gemma-2-2b-it")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--output", default="precision_report.json")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # Child process: print exactly one JSON line for the parent to collect
+        print(json.dumps(run_profile(args.worker, args.model, args.max_new_tokens)))
+        return
+
+    results = []
+    for profile in args.profiles:
+        logging.info(f"--- Benchmarking precision profile: {profile} ---")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", profile,
+             "--model", args.model, "--max-new-tokens", str(args.max_new_tokens)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            logging.error(f"❌ Profile {profile} failed:\n{completed.stderr[-2000:]}")
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'profile':<14}{'load (s)':>10}{'model RSS (MB)':>16}{'peak RSS (MB)':>15}{'tokens/s':>10}")
+    for r in results:
+        print(f"{r['profile']:<14}{r['load_seconds']:>10}{r['model_rss_mb']:>16}{r['peak_rss_mb']:>15}{r['tokens_per_second']:>10}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "max_new_tokens": args.max_new_tokens, "prompts": len(PROMPTS), "results": results}, f, indent=2)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
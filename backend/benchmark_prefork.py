@@ -0,0 +1,148 @@
+# benchmark_prefork.py
+"""
+Measures per-worker memory of pre-fork serving (serve_prefork.py) against workers that
+each load their own model, as `uvicorn --workers N` does. Every worker starts its
+scheduler, warms up and generates a few stories before memory is read from
+/proc/<pid>/smaps_rollup (Linux):
+
+- RSS counts shared weight pages in every process that maps them;
+- USS (private pages) is what each additional worker really adds;
+- PSS splits shared pages between their processes, so PSS sums to the total footprint.
+
+    python benchmark_prefork.py --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+from typing import Dict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+GENERATIONS_PER_WORKER = 3
+
+
+def process_memory_mb(pid: int) -> Dict[str, float]:
+    """RSS, PSS and USS of a process in MB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(fields["Rss"], 1),
+        "pss_mb": round(fields["Pss"], 1),
+        "uss_mb": round(fields["Private_Clean"] + fields["Private_Dirty"], 1),
+    }
+
+
+def serve_like_worker():
+    """What a worker's lifespan and first requests do with the model, without HTTP."""
+    from app.services.nlp_service import nlp_service
+
+    async def run():
+        await nlp_service._initialize_in_background()
+        for i in range(GENERATIONS_PER_WORKER):
+            story_data = {"prompt": f"A lighthouse keeper finds message number {i}", "language": "en",
+                          "genre": "fantasy", "tone": "light_hearted", "length": "short", "seed": None}
+            await nlp_service.generate_story(story_data)
+        await nlp_service.close()
+    asyncio.run(run())
+
+
+def run_standalone() -> dict:
+    """Child process: loads the model the regular way and reports its own memory."""
+    serve_like_worker()
+    return process_memory_mb(os.getpid())
+
+
+def run_prefork(workers: int) -> dict:
+    """Preloads in this process, forks workers and reads everyone's memory once they are warm."""
+    from serve_prefork import preload_model, fork_worker
+    from app.services.replica_pool import plan_core_sets
+
+    preload_model()
+    master_after_load = process_memory_mb(os.getpid())
+    core_sets = plan_core_sets(workers)
+
+    ready_read, ready_write = os.pipe()
+    exit_read, exit_write = os.pipe()
+
+    def worker():
+        serve_like_worker()
+        os.write(ready_write, b"r")
+        # Stay alive until the master has measured every worker
+        os.read(exit_read, 1)
+
+    pids = [fork_worker(worker_id, core_sets[worker_id], worker) for worker_id in range(workers)]
+    for _ in pids:
+        os.read(ready_read, 1)
+
+    result = {
+        "master_after_load": master_after_load,
+        "master": process_memory_mb(os.getpid()),
+        "workers": [process_memory_mb(pid) for pid in pids],
+    }
+    os.write(exit_write, b"x" * len(pids))
+    for pid in pids:
+        os.waitpid(pid, 0)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-worker memory of pre-fork serving")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--model", default="google/gemma-2-2b-it")
+    parser.add_argument("--output", default="prefork_report.json")
+    parser.add_argument("--mode", choices=["standalone", "prefork"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Child process: print exactly one JSON line for the parent to collect
+        from app.services.nlp_service import nlp_service
+        nlp_service.model_configs["main"]["model_name"] = args.model
+        result = run_standalone() if args.mode == "standalone" else run_prefork(args.workers)
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in ["standalone", "prefork"]:
+        logging.info(f"--- Measuring {mode} serving ---")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--mode", mode, "--workers", str(args.workers), "--model", args.model],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            logging.error(f"❌ {mode} run failed:\n{completed.stderr[-2000:]}")
+            return
+        results[mode] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    standalone, prefork = results["standalone"], results["prefork"]
+    prefork_total_pss = prefork["master"]["pss_mb"] + sum(w["pss_mb"] for w in prefork["workers"])
+    summary = {
+        "independent_worker_rss_mb": standalone["rss_mb"],
+        "independent_total_mb": round(standalone["rss_mb"] * args.workers, 1),
+        "prefork_total_pss_mb": round(prefork_total_pss, 1),
+        "prefork_extra_per_worker_mb": round(sum(w["uss_mb"] for w in prefork["workers"]) / args.workers, 1),
+    }
+
+    print(f"\n{'process':<18}{'RSS (MB)':>10}{'PSS (MB)':>10}{'USS (MB)':>10}")
+    print(f"{'standalone worker':<18}{standalone['rss_mb']:>10}{standalone['pss_mb']:>10}{standalone['uss_mb']:>10}")
+    print(f"{'prefork master':<18}{prefork['master']['rss_mb']:>10}{prefork['master']['pss_mb']:>10}{prefork['master']['uss_mb']:>10}")
+    for i, w in enumerate(prefork["workers"]):
+        print(f"{'prefork worker ' + str(i):<18}{w['rss_mb']:>10}{w['pss_mb']:>10}{w['uss_mb']:>10}")
+    print(f"\n{args.workers} independent workers: {summary['independent_total_mb']} MB; "
+          f"pre-fork master + {args.workers} workers: {summary['prefork_total_pss_mb']} MB "
+          f"({summary['prefork_extra_per_worker_mb']} MB private per worker)")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "workers": args.workers, "summary": summary, **results}, f, indent=2)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
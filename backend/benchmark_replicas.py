@@ -0,0 +1,77 @@
+# benchmark_replicas.py
+"""
+Measures aggregate generation throughput of the multi-replica inference mode
+(INFERENCE_REPLICAS) as the number of pinned replica processes grows.
+
+    python benchmark_replicas.py --replicas 1 2 4 --requests-per-replica 4 --max-new-tokens 64
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from app.core.config import settings
+from app.services.nlp_service import NLPService, _load_tokenizer_sync
+from app.services.replica_pool import ReplicaPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PROMPTS = [
+    ("A dragon and a knight become unlikely friends", "en", "fantasy"),
+    ("एक रहस्यमय घर जहां रोज नई घटनाएं होती हैं", "hi", "mystery"),
+    ("ఒక పిల్లి తన యజమాని యొక్క అన్ని రహస్యాలను చెబుతుంది", "te", "comedy"),
+]
+
+
+async def run_load(pool: ReplicaPool, prompts, max_new_tokens: int) -> dict:
+    started_at = time.perf_counter()
+    outputs = await asyncio.gather(*[pool.submit(ids, max_new_tokens) for ids in prompts])
+    elapsed = time.perf_counter() - started_at
+    generated = sum(len(out) - len(ids) for out, ids in zip(outputs, prompts))
+    return {"requests": len(prompts), "generated_tokens": generated, "seconds": round(elapsed, 2),
+            "tokens_per_second": round(generated / elapsed, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate throughput vs number of inference replicas")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads-per-replica", type=int, default=None)
+    parser.add_argument("--requests-per-replica", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--model", default="google/gemma-2-2b-it")
+    parser.add_argument("--output", default="replica_report.json")
+    args = parser.parse_args()
+
+    tokenizer = _load_tokenizer_sync(args.model, settings.MODEL_CACHE_DIR)
+    service = NLPService()
+    encoded = [
+        tokenizer.encode(service._build_gemma_prompt(prompt, language, genre, "light_hearted", "short", None, None),
+                         truncation=True, max_length=1024)
+        for prompt, language, genre in PROMPTS
+    ]
+
+    results = []
+    for num_replicas in args.replicas:
+        logging.info(f"--- Benchmarking {num_replicas} replica(s) ---")
+        pool = ReplicaPool(num_replicas, {"model_name": args.model}, args.threads_per_replica)
+        pool.start()
+        try:
+            prompts = [encoded[i % len(encoded)] for i in range(num_replicas * args.requests_per_replica)]
+            result = asyncio.run(run_load(pool, prompts, args.max_new_tokens))
+        finally:
+            pool.stop()
+        result.update({"replicas": num_replicas, "threads_per_replica": len(pool.core_sets[0])})
+        results.append(result)
+
+    print(f"\n{'replicas':>9}{'threads':>9}{'requests':>10}{'tokens':>9}{'seconds':>9}{'tokens/s':>10}")
+    for r in results:
+        print(f"{r['replicas']:>9}{r['threads_per_replica']:>9}{r['requests']:>10}{r['generated_tokens']:>9}{r['seconds']:>9}{r['tokens_per_second']:>10}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": args.model, "max_new_tokens": args.max_new_tokens, "results": results}, f, indent=2)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
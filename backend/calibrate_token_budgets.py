@@ -0,0 +1,121 @@
+# calibrate_token_budgets.py
+"""
+Measures how many tokens the model's tokenizer needs per word in each language, on the
+LoRA training stories and the stories stored in MongoDB, and persists per-language
+max_new_tokens budgets (TOKEN_BUDGETS_PATH) that the API loads with the model.
+
+For every sample and story length, the tokens needed to reach the promised word count and
+finish the sentence (SENTENCE_HEADROOM) at that sample's tokens-per-word are compared with the budget: the surplus is budget that is reserved but never decoded
+(wasted), a deficit means the story is cut off before reaching its length (truncated).
+
+    python calibrate_token_budgets.py
+    python calibrate_token_budgets.py --skip-stored --dry-run
+"""
+import argparse
+import json
+import logging
+import math
+from typing import Dict, List, Tuple
+
+from app.core.config import settings
+from app.models.story import StoryStatus
+from app.services.nlp_service import nlp_service, _load_tokenizer_sync
+from app.services.token_budgets import DEFAULT_TOKEN_BUDGETS, SENTENCE_HEADROOM, TokenBudgets, WORD_BUDGETS, token_budgets, tokens_per_word, training_samples
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def stored_samples(limit: int) -> List[Tuple[str, str]]:
+    """(language, content) of finished stories in the database."""
+    from app.core.database import db
+    if not db.connect():
+        logging.warning("⚠️ Database unavailable; calibrating on the training data only.")
+        return []
+    try:
+        stories = db.get_collection("stories").find(
+            {"status": {"$in": [StoryStatus.DONE.value, None]}, "word_count": {"$gt": 0}},
+            {"language": 1, "content": 1}
+        ).limit(limit)
+        return [(story["language"], story["content"]) for story in stories if story.get("content")]
+    finally:
+        db.close()
+
+
+def evaluate(budgets: TokenBudgets, ratios: List[Tuple[str, float]]) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Mean wasted tokens and truncation rate per language and length for the given table."""
+    totals: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for language, ratio in ratios:
+        for length, words in WORD_BUDGETS.items():
+            needed = math.ceil(words * (1 + SENTENCE_HEADROOM) * ratio)
+            budget = budgets.get(language, length)
+            row = totals.setdefault(language, {}).setdefault(length, {"samples": 0, "wasted": 0.0, "truncated": 0.0})
+            row["samples"] += 1
+            row["wasted"] += max(0, budget - needed)
+            row["truncated"] += needed > budget
+    for lengths in totals.values():
+        for row in lengths.values():
+            row["mean_wasted_tokens"] = round(row.pop("wasted") / row["samples"], 1)
+            row["truncated_rate"] = round(row.pop("truncated") / row["samples"], 3)
+    return totals
+
+
+def overall_mean_wasted(result: Dict[str, Dict[str, Dict[str, float]]]) -> float:
+    rows = [row for lengths in result.values() for row in lengths.values()]
+    samples = sum(row["samples"] for row in rows)
+    return round(sum(row["mean_wasted_tokens"] * row["samples"] for row in rows) / samples, 1) if samples else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate per-language max_new_tokens budgets")
+    parser.add_argument("--model", default=nlp_service.model_configs["main"]["model_name"])
+    parser.add_argument("--data", default="story_training_data.json")
+    parser.add_argument("--skip-stored", action="store_true", help="Do not read stored stories from MongoDB")
+    parser.add_argument("--max-stored", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="Report without writing the budget table")
+    parser.add_argument("--output", default="token_budget_report.json")
+    args = parser.parse_args()
+
+    tokenizer = _load_tokenizer_sync(args.model, settings.MODEL_CACHE_DIR)
+    samples = training_samples(args.data)
+    logging.info(f"📚 {len(samples)} training stories from {args.data}")
+    if not args.skip_stored:
+        stored = stored_samples(args.max_stored)
+        logging.info(f"📚 {len(stored)} stored stories")
+        samples += stored
+
+    ratios = [(language, ratio) for language, text in samples if (ratio := tokens_per_word(tokenizer, text)) is not None]
+    calibrated = TokenBudgets(token_budgets.path, token_budgets.max_new_tokens)
+    calibrated.calibrate(tokenizer, samples, args.model)
+    before = evaluate(TokenBudgets(token_budgets.path, token_budgets.max_new_tokens), ratios)
+    after = evaluate(calibrated, ratios)
+
+    print(f"\n{'lang':<6}{'length':<8}{'tok/word':>9}{'budget':>14}{'wasted':>16}{'truncated':>16}")
+    for language in sorted(after):
+        for length in WORD_BUDGETS:
+            old, new = before[language][length], after[language][length]
+            print(f"{language:<6}{length:<8}{calibrated.tokens_per_word[language]:>9}"
+                  f"{DEFAULT_TOKEN_BUDGETS[length]:>7}->{calibrated.get(language, length):<6}"
+                  f"{old['mean_wasted_tokens']:>8}->{new['mean_wasted_tokens']:<7}"
+                  f"{old['truncated_rate']:>8.0%}->{new['truncated_rate']:<6.0%}")
+    summary = {"mean_wasted_tokens_before": overall_mean_wasted(before), "mean_wasted_tokens_after": overall_mean_wasted(after)}
+    print(f"\nMean wasted tokens per generation: {summary['mean_wasted_tokens_before']} -> {summary['mean_wasted_tokens_after']}")
+
+    if not args.dry_run:
+        calibrated.save()
+        logging.info(f"✅ Token budgets written to {calibrated.path}; restart the API to apply them")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "model": args.model,
+            "samples": calibrated.samples,
+            "tokens_per_word": calibrated.tokens_per_word,
+            "budgets": calibrated.budgets,
+            "summary": summary,
+            "before": before,
+            "after": after,
+        }, f, indent=2)
+    logging.info(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
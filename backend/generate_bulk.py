@@ -0,0 +1,264 @@
+# generate_bulk.py
+"""
+Offline bulk story generation for content packs and training data. Reads a JSONL file of
+StoryCreate-shaped records and drives NLPService directly, without HTTP or the admission
+queue. Enough requests are kept in flight to fill the batching scheduler's padded batches
+(--batch-size). Stories are written to a JSONL file or, with --mongo, into the stories
+collection with bulk writes.
+
+Progress is checkpointed after every --flush-every stories. Running the same command again
+after the run was killed skips the stories already written. JSONL output is cut back to
+the last checkpoint, and stories written to MongoDB are keyed per input line, so nothing
+is duplicated. Records whose generation failed are retried on the next run.
+
+    python generate_bulk.py prompts.jsonl --output stories.jsonl --batch-size 32
+    python generate_bulk.py prompts.jsonl --mongo --user-id 665f1c...
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.core.config import settings
+from app.core.database import db
+from app.models.story import StoryCreate
+from app.services.generation_cache import generation_cache
+from app.services.nlp_service import nlp_service
+from app.services.story_service import story_service
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("generate_bulk")
+
+# (input line number, request, cleaned story, generated tokens)
+Result = Tuple[int, StoryCreate, str, int]
+
+
+def file_fingerprint(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_records(path: str, seed_base: Optional[int]) -> List[Tuple[int, StoryCreate]]:
+    """Valid records with their 1-based line numbers; invalid lines are logged and skipped."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                story_data = StoryCreate(**json.loads(line))
+            except (ValueError, ValidationError) as e:
+                logger.warning(f"⚠️ Skipping line {line_number}: {e}")
+                continue
+            if story_data.seed is None and seed_base is not None:
+                story_data.seed = seed_base + line_number
+            records.append((line_number, story_data))
+    return records
+
+
+class Checkpoint:
+    """Input lines already written and the length of the JSONL output at that point."""
+
+    def __init__(self, path: str, input_fingerprint: str):
+        self.path = path
+        self.input_fingerprint = input_fingerprint
+        self.done: Set[int] = set()
+        self.output_bytes = 0
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["input_fingerprint"] != self.input_fingerprint:
+            raise SystemExit(f"❌ {self.path} belongs to a different input file. Delete it to start over.")
+        self.done = set(data["done"])
+        self.output_bytes = data["output_bytes"]
+
+    def save(self):
+        """Written atomically, so a kill during the write leaves the previous checkpoint."""
+        staging_path = f"{self.path}.tmp"
+        with open(staging_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "input_fingerprint": self.input_fingerprint,
+                "output_bytes": self.output_bytes,
+                "done": sorted(self.done),
+            }, f)
+        os.replace(staging_path, self.path)
+
+
+class JsonlWriter:
+    """Appends one JSON story per line, after cutting off anything written since the last checkpoint."""
+
+    def __init__(self, path: str, offset: int):
+        self.file = open(path, "r+b" if os.path.exists(path) else "wb")
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    async def write(self, results: List[Result]) -> int:
+        for line_number, story_data, content, generated_tokens in results:
+            story = {
+                "line": line_number,
+                **story_data.generation_data(),
+                "content": content,
+                "word_count": len(content.split()),
+                "generated_tokens": generated_tokens,
+            }
+            self.file.write((json.dumps(story, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class MongoWriter:
+    """Bulk-upserts stories for one user, keyed by input file and line."""
+
+    def __init__(self, user_id: str, input_fingerprint: str):
+        # Checked once up front; every write would otherwise wait out the server selection timeout
+        if not db.connect():
+            raise SystemExit("❌ MongoDB is not reachable; check MONGODB_URI or write to --output instead.")
+        self.user_id = user_id
+        self.job = input_fingerprint[:16]
+
+    async def write(self, results: List[Result]) -> int:
+        stories = [(f"{self.job}:{line_number}", story_data, content) for line_number, story_data, content, _ in results]
+        inserted = await story_service.save_bulk_stories(self.user_id, stories)
+        if inserted < len(stories):
+            logger.info(f"♻️ {len(stories) - inserted} stories were already stored by an earlier run")
+        return 0
+
+    def close(self):
+        pass
+
+
+async def generate_one(story_data: StoryCreate) -> Dict[str, Any]:
+    """The final event of a story: "done" with content and generated_tokens, or "error"."""
+    async for event in nlp_service.stream_story(story_data.generation_data()):
+        if event["event"] != "token":
+            return event
+    return {"event": "error", "message": "Generation ended without a result"}
+
+
+async def run(args) -> Dict[str, Any]:
+    input_fingerprint = file_fingerprint(args.input)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.input}.checkpoint.json", input_fingerprint)
+    checkpoint.load()
+
+    records = read_records(args.input, args.seed_base)
+    # Neighbouring requests share an adapter and a similar token budget
+    todo = sorted(
+        (record for record in records if record[0] not in checkpoint.done),
+        key=lambda record: (record[1].language.value, record[1].genre.value, record[1].length.value)
+    )
+    logger.info(f"📋 {len(records)} valid records, {len(records) - len(todo)} already done, {len(todo)} to generate")
+    if not todo:
+        return {"generated": 0, "failed": 0}
+
+    if args.mongo:
+        writer = MongoWriter(args.user_id, input_fingerprint)
+    else:
+        writer = JsonlWriter(args.output, checkpoint.output_bytes)
+        # Offline runs need no database; seeded records still share the in-memory cache tier
+        generation_cache.persistent = False
+
+    settings.GENERATION_MAX_BATCH_SIZE = args.batch_size
+    await nlp_service._initialize_in_background()
+    if not nlp_service.is_ready:
+        writer.close()
+        raise SystemExit("❌ Model failed to load; see the log above.")
+    if nlp_service.scheduler is None:
+        logger.warning("⚠️ Batching is not available with this configuration; stories are generated one at a time per executor thread.")
+
+    pending = iter(todo)
+    buffer: List[Result] = []
+    stats = {"generated": 0, "failed": 0, "generated_tokens": 0}
+    started_at = time.perf_counter()
+
+    async def flush():
+        if not buffer:
+            return
+        results = buffer[:]
+        buffer.clear()
+        checkpoint.output_bytes = await writer.write(results)
+        checkpoint.done.update(line_number for line_number, *_ in results)
+        checkpoint.save()
+        elapsed = time.perf_counter() - started_at
+        logger.info(
+            f"💾 {stats['generated']}/{len(todo)} stories, {stats['failed']} failed, "
+            f"{stats['generated_tokens'] / elapsed:.1f} tok/s sustained"
+        )
+
+    async def worker():
+        for line_number, story_data in pending:
+            event = await generate_one(story_data)
+            if event["event"] == "done":
+                stats["generated"] += 1
+                stats["generated_tokens"] += event["generated_tokens"]
+                buffer.append((line_number, story_data, event["content"], event["generated_tokens"]))
+                if len(buffer) >= args.flush_every:
+                    await flush()
+            else:
+                stats["failed"] += 1
+                logger.warning(f"⚠️ Line {line_number} failed: {event['message']}")
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency or args.batch_size * 2)))
+    finally:
+        # Whatever finished before an interrupt is kept for the next run
+        await flush()
+        writer.close()
+        await nlp_service.close()
+
+    elapsed = time.perf_counter() - started_at
+    stats["seconds"] = round(elapsed, 1)
+    stats["sustained_tokens_per_second"] = round(stats["generated_tokens"] / elapsed, 1)
+    stats["stories_per_minute"] = round(stats["generated"] / elapsed * 60, 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate stories in bulk from a JSONL file of StoryCreate records")
+    parser.add_argument("input", help="JSONL file, one StoryCreate-shaped record per line")
+    parser.add_argument("--output", help="JSONL file to write stories to")
+    parser.add_argument("--mongo", action="store_true", help="Write stories into the stories collection instead")
+    parser.add_argument("--user-id", help="Owner of the stories written with --mongo")
+    parser.add_argument("--batch-size", type=int, default=32, help="Scheduler batch size")
+    parser.add_argument("--concurrency", type=int, help="Stories in flight (default: twice the batch size)")
+    parser.add_argument("--flush-every", type=int, default=50, help="Stories per write and checkpoint")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <input>.checkpoint.json)")
+    parser.add_argument("--model", help="Model to load instead of the configured one")
+    parser.add_argument("--seed-base", type=int, help="Seed records without one with seed-base + line number, for reproducible output")
+    args = parser.parse_args()
+
+    if args.mongo == bool(args.output):
+        parser.error("Use exactly one of --output or --mongo")
+    if args.mongo and not args.user_id:
+        parser.error("--mongo needs --user-id")
+
+    if args.model:
+        nlp_service.model_configs["main"]["model_name"] = args.model
+    try:
+        stats = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("\nInterrupted; run the same command again to resume from the last checkpoint.")
+        return
+    print(f"\nGenerated {stats['generated']} stories ({stats['failed']} failed)")
+    if stats["generated"]:
+        print(f"Sustained throughput: {stats['sustained_tokens_per_second']} tok/s, "
+              f"{stats['stories_per_minute']} stories/min over {stats['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# serve_prefork.py
+"""
+Pre-fork serving: loads (and merges) the model once in this master process, then forks
+API workers that share its weights copy-on-write. Each worker runs its own uvicorn server
+on the shared listening socket, its own batching scheduler, prefix caches and database
+connection, and pins itself to a disjoint core set. The master only loads weights. Workers
+that die are forked again from the master. With --metrics-port, worker i also serves its
+own /metrics on that port + i, so every worker can be scraped.
+
+    python serve_prefork.py --workers 4 --metrics-port 9100
+
+Use instead of `uvicorn --workers N`, where every worker would load its own model copy.
+"""
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from functools import partial
+from typing import Callable, Dict, List
+
+import torch
+import uvicorn
+
+from app.core.config import settings
+from app.core.metrics import start_metrics_server
+from app.services.nlp_service import nlp_service
+from app.services.replica_pool import plan_core_sets
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("prefork")
+
+
+def preload_model():
+    """Loads the model in the master and freezes the heap so workers do not copy it on gc."""
+    # A single thread keeps the master from starting an OpenMP pool during the LoRA merge; a pool
+    # inherited through fork can deadlock the workers' first parallel op. Workers size their own.
+    torch.set_num_threads(1)
+    if settings.INFERENCE_BACKEND.lower() == "onnx":
+        # ONNX Runtime sessions own thread pools and their own weight copy; neither survives fork usefully
+        logger.warning("⚠️ INFERENCE_BACKEND=onnx is not supported with pre-fork serving. Using eager.")
+        settings.INFERENCE_BACKEND = "eager"
+    nlp_service.preload()
+    gc.collect()
+    # Objects allocated so far are never scanned again, so the collector does not dirty their pages
+    gc.freeze()
+
+
+def fork_worker(worker_id: int, cores: List[int], target: Callable[[], None]) -> int:
+    """Forks one worker pinned to its cores; the child runs target and exits."""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    exit_code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+        target()
+    except BaseException:
+        logger.exception(f"❌ Worker {worker_id} crashed")
+        exit_code = 1
+    finally:
+        # Skip the master's atexit handlers and buffered state inherited through fork
+        os._exit(exit_code)
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing one model copy")
+    parser.add_argument("--workers", type=int, default=settings.PREFORK_WORKERS)
+    parser.add_argument("--host", default=settings.HOST)
+    parser.add_argument("--port", type=int, default=settings.PORT)
+    parser.add_argument("--metrics-port", type=int, default=settings.PREFORK_METRICS_PORT,
+                        help="Worker i serves its own /metrics on this port + i")
+    args = parser.parse_args()
+
+    preload_model()
+    # Importing the app only defines routes; each worker connects to MongoDB in its own lifespan
+    from app.main import app
+    from app.core.database import db
+    if db.client is not None:
+        raise RuntimeError("The database was connected before forking; MongoClient must be created in each worker")
+    sock = bind_socket(args.host, args.port)
+    core_sets = plan_core_sets(args.workers, settings.INFERENCE_THREADS_PER_REPLICA)
+
+    def serve(worker_id: int):
+        # /metrics on the shared socket reaches whichever worker accepts the connection
+        if args.metrics_port is not None:
+            start_metrics_server(args.host, args.metrics_port + worker_id)
+        server = uvicorn.Server(uvicorn.Config(app, lifespan="on"))
+        server.run(sockets=[sock])
+
+    workers: Dict[int, int] = {}
+    for worker_id in range(args.workers):
+        workers[fork_worker(worker_id, core_sets[worker_id], partial(serve, worker_id))] = worker_id
+    logger.info(f"✅ Forked {args.workers} API workers on http://{args.host}:{args.port}")
+    if args.metrics_port is not None:
+        logger.info(f"📈 Worker metrics on ports {args.metrics_port}-{args.metrics_port + args.workers - 1}")
+    else:
+        logger.warning("⚠️ No --metrics-port: /metrics on the API port shows a different worker on each scrape.")
+
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = workers.pop(pid, None)
+        if worker_id is None or stopping:
+            continue
+        logger.warning(f"⚠️ Worker {worker_id} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}; forking a replacement")
+        time.sleep(1)
+        workers[fork_worker(worker_id, core_sets[worker_id], partial(serve, worker_id))] = worker_id
+
+    logger.info("✅ All API workers stopped")
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.metrics import HTTP_REQUEST_DURATION, MetricsMiddleware
+
+
+def _request_counts():
+    """Observations so far per (method, route, status)."""
+    return {key: sum(child.snapshot()[0]) for key, child in HTTP_REQUEST_DURATION._children.items()}
+
+
+def _client() -> TestClient:
+    stories, auth, mounted = APIRouter(), APIRouter(), FastAPI()
+
+    @stories.get("/")
+    async def list_stories():
+        return []
+
+    @stories.get("/{story_id}")
+    async def get_story(story_id: str):
+        return {"id": story_id}
+
+    @auth.get("/")
+    async def auth_root():
+        return {}
+
+    @mounted.get("/ping")
+    async def ping():
+        return {}
+
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {}
+
+    app.include_router(stories, prefix="/api/v1/stories")
+    app.include_router(auth, prefix="/api/v1/auth")
+    app.mount("/mounted", mounted)
+    app.add_middleware(MetricsMiddleware)
+    return TestClient(app)
+
+
+def test_routes_with_the_same_relative_path_get_distinct_labels():
+    client = _client()
+    before = _request_counts()
+    for path in ("/", "/api/v1/stories/", "/api/v1/auth/"):
+        assert client.get(path).status_code == 200
+
+    counts = _request_counts()
+    for route in ("/", "/api/v1/stories/", "/api/v1/auth/"):
+        key = ("GET", route, "200")
+        assert counts[key] - before.get(key, 0) == 1
+
+
+def test_path_parameters_and_mounts_are_labelled_by_template():
+    client = _client()
+    before = _request_counts()
+    for path in ("/api/v1/stories/abc", "/api/v1/stories/def", "/mounted/ping", "/missing"):
+        client.get(path)
+
+    counts = _request_counts()
+    assert counts[("GET", "/api/v1/stories/{story_id}", "200")] - before.get(("GET", "/api/v1/stories/{story_id}", "200"), 0) == 2
+    assert counts[("GET", "/mounted/ping", "200")] - before.get(("GET", "/mounted/ping", "200"), 0) == 1
+    assert counts[("GET", "unmatched", "404")] - before.get(("GET", "unmatched", "404"), 0) == 1
+    assert not any(route.endswith(("/abc", "/def")) for _, route, _ in counts)